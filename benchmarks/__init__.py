@@ -0,0 +1,2 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
@@ -0,0 +1,170 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Golden output checks and micro-benchmark of htmlrst.Converter.
+
+The corpus in htmlrst_corpus/ holds Javadoc fragments (NAME.html) along with
+their expected reST output (NAME.rst). Run from the root of the source tree,
+
+    python -m benchmarks.converter --check
+    python -m benchmarks.converter --update
+    python -m benchmarks.converter -o results.json
+
+"""
+
+import codecs
+import difflib
+import os
+import sys
+import time
+
+from optparse import OptionParser
+
+from javasphinx import htmlrst
+
+from benchmarks import results
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'htmlrst_corpus')
+
+def read_file(path):
+    f = codecs.open(path, 'r', 'utf8')
+    content = f.read()
+    f.close()
+
+    return content
+
+def write_file(path, content):
+    f = codecs.open(path, 'w', 'utf8')
+    f.write(content)
+    f.close()
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    """ Get a sorted list of (name, fragment) tuples """
+
+    corpus = []
+
+    for filename in sorted(os.listdir(corpus_dir)):
+        name, ext = os.path.splitext(filename)
+
+        if ext == '.html':
+            corpus.append((name, read_file(os.path.join(corpus_dir, filename))))
+
+    return corpus
+
+def get_golden_path(name, corpus_dir=CORPUS_DIR):
+    return os.path.join(corpus_dir, name + '.rst')
+
+def check(converter, corpus, out=sys.stdout):
+    """ Compare the output for each fragment to its golden output. Returns the
+    names of fragments whose output differs. """
+
+    failures = []
+
+    for name, fragment in corpus:
+        path = get_golden_path(name)
+        actual = converter.convert(fragment)
+
+        if not os.path.exists(path):
+            out.write('%s: no golden output, run with --update\n' % (name,))
+            failures.append(name)
+            continue
+
+        expected = read_file(path)
+
+        if actual != expected:
+            failures.append(name)
+            diff = difflib.unified_diff(expected.splitlines(True), actual.splitlines(True),
+                                        name + '.rst', name + ' (actual)')
+            out.write(''.join(diff).encode('utf8') + '\n')
+
+    return failures
+
+def update(converter, corpus):
+    for name, fragment in corpus:
+        write_file(get_golden_path(name), converter.convert(fragment))
+
+def percentile(sorted_values, fraction):
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def benchmark(converter, corpus, iterations):
+    """ Convert the whole corpus the given number of times. Returns the total
+    time and the sorted latencies of individual conversions. """
+
+    latencies = []
+    clock = time.time
+    start = clock()
+
+    for _ in range(iterations):
+        for _, fragment in corpus:
+            fragment_start = clock()
+            converter.convert(fragment)
+            latencies.append(clock() - fragment_start)
+
+    total = clock() - start
+    latencies.sort()
+
+    return total, latencies
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='python -m benchmarks.converter [options]')
+
+    parser.add_option('--check', action='store_true', dest='check',
+                      help='Compare the output to the golden output and exit')
+    parser.add_option('--update', action='store_true', dest='update',
+                      help='Rewrite the golden output and exit')
+    parser.add_option('-n', '--iterations', type='int', dest='iterations', default=200,
+                      help='Number of times to convert the corpus (default: 200)')
+    parser.add_option('-o', '--output', dest='output',
+                      help='Write the results to the given JSON file')
+    parser.add_option('--compare', dest='compare',
+                      help='Compare the results to those stored in the given JSON file')
+    parser.add_option('--threshold', type='float', dest='threshold', default=0.1,
+                      help='Slowdown reported as a regression when comparing (default: 0.1)')
+
+    (opts, args) = parser.parse_args(argv[1:])
+
+    converter = htmlrst.Converter()
+    corpus = load_corpus()
+
+    if opts.update:
+        update(converter, corpus)
+        return
+
+    # Never measure a converter which produces the wrong output
+    failures = check(converter, corpus)
+
+    if failures:
+        sys.stderr.write('Output differs for: %s\n' % (', '.join(failures),))
+        sys.exit(1)
+
+    if opts.check:
+        print '%d fragments OK' % (len(corpus),)
+        return
+
+    # Warm up caches before measuring
+    benchmark(converter, corpus, 1)
+    total, latencies = benchmark(converter, corpus, opts.iterations)
+
+    print '%d fragments in %.3fs: %.1f fragments/s' % (len(latencies), total, len(latencies) / total)
+
+    for label, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)):
+        print '%s latency %.3fms' % (label, percentile(latencies, fraction) * 1000)
+
+    bench_results = results.Results('converter', {'fragments': len(corpus), 'iterations': opts.iterations})
+    bench_results.add('convert_corpus', [total], fragments_per_second=len(latencies) / total,
+                      p50=percentile(latencies, 0.5), p90=percentile(latencies, 0.9),
+                      p99=percentile(latencies, 0.99))
+
+    if opts.output:
+        bench_results.write(opts.output)
+
+    if opts.compare:
+        regressions = results.compare(results.load(opts.compare), bench_results.data, opts.threshold)
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
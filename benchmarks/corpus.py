@@ -0,0 +1,176 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Seeded generator of synthetic Java projects for benchmarking.
+
+"""
+
+import os
+import random
+
+BASE_PACKAGE = 'com.example.bench'
+
+PRIMITIVE_TYPES = ['int', 'long', 'boolean', 'double', 'String', 'Object']
+
+WORDS = ('the value of a widget frame buffer request response handler index '
+         'cache entry stream token parser result source target number list map '
+         'element node context state manager factory listener event').split()
+
+class CorpusOptions(object):
+    """ Shape of a generated project. The html, tables and code options give
+    the fraction of Javadoc comments using heavy HTML, tables and code
+    blocks respectively, the remainder being plain text. """
+
+    def __init__(self, seed=0, packages=10, types=20, members=10, depth=1,
+                 html=0.3, tables=0.1, code=0.2):
+        self.seed = seed
+        self.packages = packages
+        self.types = types
+        self.members = members
+        self.depth = depth
+        self.html = html
+        self.tables = tables
+        self.code = code
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+class CorpusGenerator(object):
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.package_names = ['%s.p%d' % (BASE_PACKAGE, i) for i in range(options.packages)]
+        self.type_names = ['Type%d' % (i,) for i in range(options.types)]
+
+    def words(self, count):
+        return ' '.join(self.random.choice(WORDS) for _ in range(count))
+
+    def sentence(self):
+        return self.words(self.random.randint(4, 12)).capitalize() + '.'
+
+    def type_ref(self):
+        package = self.random.choice(self.package_names)
+        name = self.random.choice(self.type_names)
+        return package + '.' + name
+
+    def plain_doc(self):
+        return ' '.join(self.sentence() for _ in range(self.random.randint(1, 3)))
+
+    def html_doc(self):
+        items = ''.join('<li>%s <i>%s</i></li>' % (self.sentence(), self.words(2))
+                        for _ in range(self.random.randint(2, 5)))
+
+        return ('<p>%s See {@link %s} and <a href="http://example.com/%s">%s</a>.</p>\n'
+                '<p><b>%s</b> %s</p>\n<ul>%s</ul>') % (
+            self.sentence(), self.type_ref(), self.words(1), self.words(2),
+            self.words(2), self.sentence(), items)
+
+    def table_doc(self):
+        rows = ''.join('<tr><td>{@code %s}</td><td>%s</td></tr>' % (self.words(1), self.sentence())
+                       for _ in range(self.random.randint(2, 6)))
+
+        return ('%s\n<table border="1">\n<tr><th>Name</th><th>Description</th></tr>\n%s\n</table>') % (
+            self.sentence(), rows)
+
+    def code_doc(self):
+        lines = '\n'.join('    %s.%s(%d);' % (self.words(1), self.words(1), i)
+                          for i in range(self.random.randint(2, 8)))
+
+        return '%s Use {@code %s} as follows,\n<pre>{@code\n%s\n}</pre>' % (
+            self.sentence(), self.words(1), lines)
+
+    def doc(self, tags=()):
+        """ Get a Javadoc comment ending with the given block tags """
+
+        options = self.options
+        choice = self.random.random()
+
+        if choice < options.html:
+            text = self.html_doc()
+        elif choice < options.html + options.tables:
+            text = self.table_doc()
+        elif choice < options.html + options.tables + options.code:
+            text = self.code_doc()
+        else:
+            text = self.plain_doc()
+
+        lines = text.split('\n') + list(tags)
+        return '/**\n' + ''.join(' * %s\n' % (line,) for line in lines) + ' */\n'
+
+    def method(self, index):
+        params = [(self.random.choice(PRIMITIVE_TYPES + [self.type_ref()]), 'arg%d' % (i,))
+                  for i in range(self.random.randint(0, 3))]
+        tags = ['@param %s %s' % (name, self.words(3)) for _, name in params]
+        tags.append('@return %s' % (self.words(3),))
+
+        if self.random.random() < 0.2:
+            tags.append('@throws java.io.IOException %s' % (self.words(3),))
+            throws = ' throws java.io.IOException'
+        else:
+            throws = ''
+
+        return_type = self.random.choice(PRIMITIVE_TYPES + [self.type_ref()])
+        signature = ', '.join('%s %s' % param for param in params)
+
+        return '%spublic %s method%d(%s)%s {\n    return %s;\n}\n' % (
+            self.doc(tags), return_type, index, signature, throws,
+            'false' if return_type == 'boolean' else ('0' if return_type in ('int', 'long', 'double') else 'null'))
+
+    def field(self, index):
+        return '%spublic %s field%d;\n' % (self.doc(), self.random.choice(PRIMITIVE_TYPES), index)
+
+    def constructor(self, name):
+        return '%spublic %s(int value) {\n}\n' % (self.doc(['@param value %s' % (self.words(3),)]), name)
+
+    def type_body(self, name, depth):
+        members = []
+
+        for i in range(self.options.members):
+            kind = self.random.random()
+
+            if kind < 0.2:
+                members.append(self.field(i))
+            elif kind < 0.3:
+                members.append(self.constructor(name))
+            else:
+                members.append(self.method(i))
+
+        if depth > 0:
+            nested = 'Nested%d' % (depth,)
+            members.append(self.doc() + 'public static class %s {\n%s}\n' % (
+                nested, self.type_body(nested, depth - 1)))
+
+        return ''.join('    ' + line + '\n' if line else '\n'
+                       for member in members for line in member.split('\n'))
+
+    def compilation_unit(self, package, name):
+        return 'package %s;\n\n%spublic class %s {\n%s}\n' % (
+            package, self.doc(['@author %s' % (self.words(1),)]), name,
+            self.type_body(name, self.options.depth))
+
+    def write(self, path):
+        """ Write the project's sources below the given directory. Returns the
+        list of files written. """
+
+        files = []
+
+        for package in self.package_names:
+            package_path = os.path.join(path, *package.split('.'))
+
+            if not os.path.isdir(package_path):
+                os.makedirs(package_path)
+
+            for name in self.type_names:
+                filename = os.path.join(package_path, name + '.java')
+
+                f = open(filename, 'w')
+                f.write(self.compilation_unit(package, name))
+                f.close()
+
+                files.append(filename)
+
+        return files
+
+def generate_corpus(path, options):
+    return CorpusGenerator(options).write(path)
@@ -0,0 +1,254 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Benchmark of the read and resolve phases of the Java domain.
+
+Generates a Sphinx project with the given number of java:type and java:method
+directives and java:ref/java:type roles, builds it in process and times the
+domain methods involved, a full and an incremental rebuild, and the size of
+the pickled environment. Run from the root of the source tree,
+
+    python -m benchmarks.domain -o results.json
+
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+from sphinx.application import Sphinx
+
+from javasphinx import domain
+
+from benchmarks import results
+
+SPHINX_CONF = """
+extensions = ['javasphinx']
+master_doc = 'index'
+project = 'Benchmark'
+"""
+
+class Instrument(object):
+    """ Accumulates the time spent in, and number of calls to, methods
+    replaced by timing wrappers. """
+
+    def __init__(self):
+        self.timings = {}
+        self.calls = {}
+        self.originals = []
+
+    def wrap(self, cls, attr, name):
+        original = cls.__dict__[attr]
+        timings = self.timings
+        calls = self.calls
+
+        timings[name] = 0.0
+        calls[name] = 0
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+
+            try:
+                return original(*args, **kwargs)
+            finally:
+                timings[name] += time.time() - start
+                calls[name] += 1
+
+        setattr(cls, attr, wrapper)
+        self.originals.append((cls, attr, original))
+
+    def reset(self):
+        for name in self.timings:
+            self.timings[name] = 0.0
+            self.calls[name] = 0
+
+    def restore(self):
+        for cls, attr, original in reversed(self.originals):
+            setattr(cls, attr, original)
+
+        self.originals = []
+
+def generate_project(path, seed, types, methods, refs, documents):
+    """ Write a project of the given number of documents, sharing the types
+    between them. Each type has the given number of methods, and the
+    references are spread evenly over the documents. """
+
+    rng = random.Random(seed)
+    names = []
+
+    for i in range(types):
+        package = 'com.example.p%d' % (i % max(1, types // 20),)
+        names.append((package, 'Type%d' % (i,)))
+
+    docs = [[] for _ in range(documents)]
+
+    for i, (package, name) in enumerate(names):
+        lines = docs[i % documents]
+        lines.append('.. java:package:: %s\n   :noindex:\n' % (package,))
+        lines.append('.. java:type:: public class %s\n\n   Type %s.\n' % (name, name))
+
+        for j in range(methods):
+            lines.append('   .. java:method:: public %s method%d(int value, %s other)\n      :outertype: %s\n\n'
+                         '      Method %d.\n' % (rng.choice(['void', 'int', 'String']), j,
+                                                rng.choice(names[:i + 1])[1], name, j))
+
+    for i in range(refs):
+        package, name = rng.choice(names)
+
+        if rng.random() < 0.5:
+            role = ':java:type:`%s.%s`' % (package, name)
+        else:
+            role = ':java:ref:`%s.%s.method%d(int, %s)`' % (package, name, rng.randrange(max(1, methods)),
+                                                               rng.choice(names)[1])
+
+        docs[i % documents].append('Reference to %s.\n' % (role,))
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    for i, lines in enumerate(docs):
+        f = open(os.path.join(path, 'doc%d.rst' % (i,)), 'w')
+        f.write('Document %d\n===========\n\n' % (i,))
+        f.write('\n'.join(lines))
+        f.close()
+
+    f = open(os.path.join(path, 'index.rst'), 'w')
+    f.write('Benchmark\n=========\n\n.. toctree::\n\n')
+    f.write(''.join('   doc%d\n' % (i,) for i in range(documents)))
+    f.close()
+
+    f = open(os.path.join(path, 'conf.py'), 'w')
+    f.write(SPHINX_CONF)
+    f.close()
+
+def build(srcdir, workdir, fresh):
+    """ Build the project, returning the elapsed time """
+
+    devnull = open(os.devnull, 'w')
+
+    try:
+        start = time.time()
+        app = Sphinx(srcdir, srcdir, os.path.join(workdir, 'html'), os.path.join(workdir, 'doctrees'),
+                     'html', status=None, warning=devnull, freshenv=fresh)
+        app.build()
+        return time.time() - start
+    finally:
+        devnull.close()
+
+def touch_documents(srcdir, count):
+    """ Change the given number of documents so they must be read again """
+
+    for i in range(count):
+        path = os.path.join(srcdir, 'doc%d.rst' % (i,))
+
+        f = open(path, 'a')
+        f.write('\n')
+        f.close()
+
+        # Make sure the change is noticed on file systems with coarse mtimes
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 2))
+
+def run_benchmarks(opts, workdir):
+    srcdir = os.path.join(workdir, 'src')
+    generate_project(srcdir, opts.seed, opts.types, opts.methods, opts.refs, opts.documents)
+
+    instrument = Instrument()
+    instrument.wrap(domain.JavaObject, 'handle_signature', 'handle_signature')
+    instrument.wrap(domain.JavaObject, 'add_target_and_index', 'add_target_and_index')
+    instrument.wrap(domain.JavaDomain, 'resolve_xref', 'resolve_xref')
+    instrument.wrap(domain.JavaDomain, 'clear_doc', 'clear_doc')
+
+    timings = dict((name, []) for name in ('full_build', 'incremental_build', 'handle_signature',
+                                           'add_target_and_index', 'resolve_xref', 'clear_doc'))
+    calls = {}
+
+    try:
+        for _ in range(opts.repeat):
+            instrument.reset()
+            timings['full_build'].append(build(srcdir, workdir, True))
+
+            for name in ('handle_signature', 'add_target_and_index', 'resolve_xref'):
+                timings[name].append(instrument.timings[name])
+                calls[name] = instrument.calls[name]
+
+            touch_documents(srcdir, opts.changed)
+
+            instrument.reset()
+            timings['incremental_build'].append(build(srcdir, workdir, False))
+            timings['clear_doc'].append(instrument.timings['clear_doc'])
+            calls['clear_doc'] = instrument.calls['clear_doc']
+    finally:
+        instrument.restore()
+
+    parameters = dict((name, getattr(opts, name))
+                      for name in ('seed', 'types', 'methods', 'refs', 'documents', 'changed'))
+    bench_results = results.Results('domain', parameters)
+
+    for name, values in timings.items():
+        if name in calls:
+            bench_results.add(name, values, calls=calls[name])
+        else:
+            bench_results.add(name, values)
+
+    pickle_path = os.path.join(workdir, 'doctrees', 'environment.pickle')
+    bench_results.data['environment_pickle_size'] = os.path.getsize(pickle_path)
+
+    return bench_results
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='python -m benchmarks.domain [options]')
+
+    parser.add_option('--seed', type='int', dest='seed', default=0,
+                      help='Seed of the generated project (default: 0)')
+    parser.add_option('--types', type='int', dest='types', default=200,
+                      help='Number of java:type directives (default: 200)')
+    parser.add_option('--methods', type='int', dest='methods', default=10,
+                      help='Number of java:method directives per type (default: 10)')
+    parser.add_option('--refs', type='int', dest='refs', default=2000,
+                      help='Number of java:ref and java:type roles (default: 2000)')
+    parser.add_option('--documents', type='int', dest='documents', default=20,
+                      help='Number of documents (default: 20)')
+    parser.add_option('--changed', type='int', dest='changed', default=1,
+                      help='Number of documents changed before the incremental build (default: 1)')
+    parser.add_option('-r', '--repeat', type='int', dest='repeat', default=3,
+                      help='Number of times to run each benchmark (default: 3)')
+    parser.add_option('-o', '--output', dest='output',
+                      help='Write the results to the given JSON file')
+    parser.add_option('--compare', dest='compare',
+                      help='Compare the results to those stored in the given JSON file')
+    parser.add_option('--threshold', type='float', dest='threshold', default=0.1,
+                      help='Slowdown reported as a regression when comparing (default: 0.1)')
+
+    (opts, args) = parser.parse_args(argv[1:])
+
+    workdir = tempfile.mkdtemp(prefix='javasphinx-bench-')
+
+    try:
+        bench_results = run_benchmarks(opts, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    for name, entry in sorted(bench_results.data['benchmarks'].items()):
+        print '%-24s min %.4fs  median %.4fs  %s' % (name, entry['min'], entry['median'],
+                                                     '%d calls' % (entry['calls'],) if 'calls' in entry else '')
+
+    print 'environment pickle       %d bytes' % (bench_results.data['environment_pickle_size'],)
+
+    if opts.output:
+        bench_results.write(opts.output)
+
+    if opts.compare:
+        regressions = results.compare(results.load(opts.compare), bench_results.data, opts.threshold)
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
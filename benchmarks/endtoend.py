@@ -0,0 +1,175 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+End to end benchmark of javasphinx-apidoc and sphinx-build on a synthetic Java
+project.
+
+Run from the root of the source tree,
+
+    python -m benchmarks.endtoend -o results.json
+    python -m benchmarks.endtoend --compare results.json
+
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser, Values
+
+from javasphinx import apidoc
+
+from benchmarks import corpus, results
+
+SPHINX_CONF = """
+extensions = ['javasphinx']
+master_doc = 'index'
+project = 'Benchmark'
+"""
+
+SPHINX_INDEX = """
+Benchmark
+=========
+
+.. toctree::
+
+   api/packages
+"""
+
+def timed(function, *args):
+    start = time.time()
+    value = function(*args)
+    return time.time() - start, value
+
+def get_write_options(destdir):
+    return Values({'destdir': destdir, 'suffix': 'rst', 'force': True, 'update': False})
+
+def run_sphinx_build(project_dir, output_dir):
+    """ Run a full HTML build of the project in a new process, using the
+    javasphinx package of this source tree. """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(apidoc.__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    devnull = open(os.devnull, 'w')
+
+    try:
+        subprocess.check_call([sys.executable, '-m', 'sphinx', '-Q', '-E', '-b', 'html',
+                               project_dir, output_dir], env=env, stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+
+def run_benchmarks(opts, corpus_options, workdir):
+    source_dir = os.path.join(workdir, 'src')
+    project_dir = os.path.join(workdir, 'doc')
+    api_dir = os.path.join(project_dir, 'api')
+
+    source_files = corpus.generate_corpus(source_dir, corpus_options)
+
+    os.makedirs(project_dir)
+
+    for filename, content in (('conf.py', SPHINX_CONF), ('index.rst', SPHINX_INDEX)):
+        f = open(os.path.join(project_dir, filename), 'w')
+        f.write(content)
+        f.close()
+
+    bench_results = results.Results('endtoend', corpus_options.as_dict())
+    generate_timings = []
+    write_timings = []
+    sphinx_timings = []
+
+    for i in range(opts.repeat):
+        elapsed, (packages, documents, sources) = timed(apidoc.generate_documents, source_files, None, False)
+        generate_timings.append(elapsed)
+
+        if os.path.isdir(api_dir):
+            shutil.rmtree(api_dir)
+
+        def write():
+            package_contents = apidoc.write_documents(documents, sources, get_write_options(api_dir))
+            apidoc.write_package_indexes(package_contents, get_write_options(api_dir))
+            apidoc.write_toc(packages, get_write_options(api_dir))
+
+        elapsed, _ = timed(write)
+        write_timings.append(elapsed)
+
+        if not opts.no_sphinx:
+            elapsed, _ = timed(run_sphinx_build, project_dir, os.path.join(workdir, 'html'))
+            sphinx_timings.append(elapsed)
+
+    bench_results.add('generate_documents', generate_timings, sources=len(source_files),
+                      documents=len(documents))
+    bench_results.add('write_documents', write_timings, documents=len(documents))
+
+    if sphinx_timings:
+        bench_results.add('sphinx_build', sphinx_timings)
+
+    return bench_results
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='python -m benchmarks.endtoend [options]')
+
+    parser.add_option('--seed', type='int', dest='seed', default=0,
+                      help='Seed of the generated project (default: 0)')
+    parser.add_option('--packages', type='int', dest='packages', default=10,
+                      help='Number of packages (default: 10)')
+    parser.add_option('--types', type='int', dest='types', default=20,
+                      help='Number of types per package (default: 20)')
+    parser.add_option('--members', type='int', dest='members', default=10,
+                      help='Number of members per type (default: 10)')
+    parser.add_option('--depth', type='int', dest='depth', default=1,
+                      help='Nesting depth of inner classes (default: 1)')
+    parser.add_option('--html', type='float', dest='html', default=0.3,
+                      help='Fraction of Javadoc comments with heavy HTML (default: 0.3)')
+    parser.add_option('--tables', type='float', dest='tables', default=0.1,
+                      help='Fraction of Javadoc comments with tables (default: 0.1)')
+    parser.add_option('--code', type='float', dest='code', default=0.2,
+                      help='Fraction of Javadoc comments with code blocks (default: 0.2)')
+    parser.add_option('-r', '--repeat', type='int', dest='repeat', default=3,
+                      help='Number of times to run each benchmark (default: 3)')
+    parser.add_option('--no-sphinx', action='store_true', dest='no_sphinx',
+                      help='Skip the sphinx-build benchmark')
+    parser.add_option('-o', '--output', dest='output',
+                      help='Write the results to the given JSON file')
+    parser.add_option('--compare', dest='compare',
+                      help='Compare the results to those stored in the given JSON file')
+    parser.add_option('--threshold', type='float', dest='threshold', default=0.1,
+                      help='Slowdown reported as a regression when comparing (default: 0.1)')
+    parser.add_option('-k', '--keep', action='store_true', dest='keep',
+                      help='Keep the generated project')
+
+    (opts, args) = parser.parse_args(argv[1:])
+
+    corpus_options = corpus.CorpusOptions(seed=opts.seed, packages=opts.packages, types=opts.types,
+                                          members=opts.members, depth=opts.depth, html=opts.html,
+                                          tables=opts.tables, code=opts.code)
+
+    workdir = tempfile.mkdtemp(prefix='javasphinx-bench-')
+
+    try:
+        bench_results = run_benchmarks(opts, corpus_options, workdir)
+    finally:
+        if opts.keep:
+            print 'Generated project kept in', workdir
+        else:
+            shutil.rmtree(workdir)
+
+    for name, entry in sorted(bench_results.data['benchmarks'].items()):
+        print '%-24s min %.4fs  median %.4fs' % (name, entry['min'], entry['median'])
+
+    if opts.output:
+        bench_results.write(opts.output)
+
+    if opts.compare:
+        regressions = results.compare(results.load(opts.compare), bench_results.data, opts.threshold)
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Benchmark of the time taken to import javasphinx.
+
+Each import is timed in a new interpreter, so nothing is already loaded.
+Run from the root of the source tree,
+
+    python -m benchmarks.imports -o results.json
+
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from optparse import OptionParser
+
+from benchmarks import results
+
+# Modules which should only be loaded once they are needed
+HEAVY_MODULES = ('sphinx', 'javalang', 'bs4', 'lxml', 'multiprocessing.pool')
+
+# Name, modules imported beforehand, statement to time
+SCENARIOS = [
+    ('apidoc', [], 'import javasphinx.apidoc'),
+    ('extension', ['sphinx.application'], 'import javasphinx.domain')
+    ]
+
+TIMER = """
+import json, sys, time
+%s
+before = set(sys.modules)
+start = time.time()
+%s
+elapsed = time.time() - start
+json.dump({'elapsed': elapsed,
+           'loaded': [name for name in %r if name in sys.modules and name not in before]}, sys.stdout)
+"""
+
+def time_import(setup, statement):
+    """ Time the statement in a new interpreter. Returns the elapsed time and
+    which of the heavy modules it loaded. """
+
+    code = TIMER % ('\n'.join('import ' + module for module in setup), statement,
+                    tuple(HEAVY_MODULES))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=root, stdout=subprocess.PIPE)
+    output, _ = process.communicate()
+
+    if process.returncode != 0:
+        raise RuntimeError('timing %r failed' % (statement,))
+
+    data = json.loads(output)
+
+    return data['elapsed'], data['loaded']
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='python -m benchmarks.imports [options]')
+
+    parser.add_option('-r', '--repeat', type='int', dest='repeat', default=10,
+                      help='Number of times to time each import (default: 10)')
+    parser.add_option('-o', '--output', dest='output',
+                      help='Write the results to the given JSON file')
+    parser.add_option('--compare', dest='compare',
+                      help='Compare the results to those stored in the given JSON file')
+    parser.add_option('--threshold', type='float', dest='threshold', default=0.1,
+                      help='Slowdown reported as a regression when comparing (default: 0.1)')
+
+    (opts, args) = parser.parse_args(argv[1:])
+
+    bench_results = results.Results('imports', {'repeat': opts.repeat})
+
+    for name, setup, statement in SCENARIOS:
+        timings = []
+
+        for _ in range(opts.repeat):
+            elapsed, loaded = time_import(setup, statement)
+            timings.append(elapsed)
+
+        bench_results.add(name, timings, loaded=loaded)
+
+        entry = bench_results.data['benchmarks'][name]
+        print '%-12s min %.1fms  median %.1fms  loads %s' % (name, entry['min'] * 1000, entry['median'] * 1000,
+                                                            ', '.join(loaded) or 'no heavy modules')
+
+    if opts.output:
+        bench_results.write(opts.output)
+
+    if opts.compare:
+        regressions = results.compare(results.load(opts.compare), bench_results.data, opts.threshold)
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Storage and comparison of benchmark results.
+
+Results are kept as JSON files holding the parameters of the run along with
+the individual timings of each benchmark, so later runs can be compared
+against them.
+
+"""
+
+import json
+import platform
+import subprocess
+import sys
+import time
+
+def get_revision():
+    """ Get the git revision of the working tree, or None outside of git """
+
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+
+    output, _ = process.communicate()
+
+    if process.returncode != 0:
+        return None
+
+    return output.strip()
+
+def summarize(timings):
+    timings = sorted(timings)
+    middle = len(timings) // 2
+
+    if len(timings) % 2:
+        median = timings[middle]
+    else:
+        median = (timings[middle - 1] + timings[middle]) / 2.0
+
+    return {'runs': timings, 'min': timings[0], 'median': median}
+
+class Results(object):
+    def __init__(self, name, parameters):
+        self.data = {
+            'name': name,
+            'parameters': parameters,
+            'python': platform.python_version(),
+            'revision': get_revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'benchmarks': {}
+            }
+
+    def add(self, benchmark, timings, **extra):
+        """ Record the timings (in seconds) of the given benchmark, along with
+        any extra values describing it. """
+
+        entry = summarize(timings)
+        entry.update(extra)
+        self.data['benchmarks'][benchmark] = entry
+
+    def write(self, filename):
+        f = open(filename, 'w')
+        json.dump(self.data, f, indent=2, sort_keys=True)
+        f.write('\n')
+        f.close()
+
+def load(filename):
+    f = open(filename)
+    data = json.load(f)
+    f.close()
+
+    return data
+
+def compare(baseline, current, threshold=0.1, out=sys.stdout):
+    """ Print the change in the median timing of each benchmark found in both
+    result sets. Returns the names of benchmarks which got slower by more than
+    the given fraction. """
+
+    if baseline['parameters'] != current['parameters']:
+        out.write('Warning: results were produced with different parameters\n')
+
+    regressions = []
+
+    for name in sorted(current['benchmarks']):
+        if name not in baseline['benchmarks']:
+            continue
+
+        before = baseline['benchmarks'][name]['median']
+        after = current['benchmarks'][name]['median']
+        change = (after - before) / before if before else 0.0
+
+        if change > threshold:
+            regressions.append(name)
+            marker = '  REGRESSION'
+        else:
+            marker = ''
+
+        out.write('%-24s %10.4fs %10.4fs %+8.1f%%%s\n' % (name, before, after, change * 100, marker))
+
+    return regressions
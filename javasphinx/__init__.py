@@ -1,11 +1,30 @@
 # Copyright (c) 2012 Bronto Software Inc.
 # Licensed under the MIT License
 
-from domain import JavaDomain
-from extdoc import javadoc_role
-
 def setup(app):
+    # Imported here rather than at module level so that importing the package,
+    # e.g. for the javasphinx-apidoc entry point, doesn't load Sphinx
+    from autodoc import (close_source_archives, generate_virtual_documents,
+                         get_outdated_virtual_documents, read_virtual_document)
+    from domain import JavaDomain
+    from extdoc import javadoc_role, refresh_inventories
+    from inventory import export_inventory, refresh_inventory_index
+
     app.add_domain(JavaDomain)
 
     app.add_config_value('javadoc_url_map', dict(), '')
+    app.add_config_value('javasphinx_export_inventory', False, 'html')
+    app.add_config_value('javasphinx_inventories', dict(), 'env')
+    app.add_config_value('javasphinx_search_priorities', dict(), 'html')
+    app.add_config_value('javasphinx_search_overloads', True, 'html')
+    app.add_config_value('javasphinx_source_paths', list(), 'env')
+    app.add_config_value('javasphinx_apidoc_dir', None, 'env')
     app.add_role('java:extdoc', javadoc_role)
+
+    app.connect('builder-inited', refresh_inventories)
+    app.connect('builder-inited', refresh_inventory_index)
+    app.connect('builder-inited', generate_virtual_documents)
+    app.connect('env-get-outdated', get_outdated_virtual_documents)
+    app.connect('source-read', read_virtual_document)
+    app.connect('build-finished', export_inventory)
+    app.connect('build-finished', close_source_archives)
@@ -1,22 +1,61 @@
 # Copyright (c) 2012 Bronto Software Inc.
 # Licensed under the MIT License
 
-import cPickle as pickle
-
+import contextlib
+import glob
+import hashlib
+import json
+import re
+import subprocess
 import sys
 import os
 import os.path
+import tempfile
+import threading
+import zipfile
+import Queue
 
 from optparse import OptionParser
 
-import javalang
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
+import cache
 import compiler
+import profiling
 import util
 
+javalang = util.LazyModule('javalang')
+
+# Separates an archive's path from the name of a source file within it
+ARCHIVE_SEPARATOR = '!/'
+
+# Name of the partial package manifests written by sharded runs
+MANIFEST_FILENAME = '.javasphinx-shard-%d-of-%d.json'
+
+# Name of the map from source files to the documents written for them, used by
+# --since to remove documents which are no longer generated
+SOURCES_FILENAME = '.javasphinx-sources.json'
+
+# Name of the list of package-tree pages written by --max-toc-entries, used to
+# remove the pages of package hierarchy nodes which no longer exist
+TREE_FILENAME = '.javasphinx-tree.json'
+
+# File suffixes of the supported model output formats
+MODEL_SUFFIXES = {
+    'json': 'jsonl',
+    'msgpack': 'msgpack'
+    }
+
 def find_source_files(input_path, excludes):
     """ Get a list of filenames for all Java source files within the given
-    directory.
+    directory. Directories matching excludes (as compiled by compile_excludes)
+    are skipped along with their contents.
 
     """
 
@@ -24,30 +63,519 @@ def find_source_files(input_path, excludes):
 
     input_path = os.path.normpath(os.path.abspath(input_path))
 
-    for dirpath, dirnames, filenames in os.walk(input_path):
-        if is_excluded(dirpath, excludes):
-            del dirnames[:]
+    if is_excluded(input_path, excludes):
+        return java_files
+
+    if scandir is None:
+        for dirpath, dirnames, filenames in os.walk(input_path):
+            dirnames[:] = [d for d in dirnames if not is_excluded(os.path.join(dirpath, d), excludes)]
+
+            for filename in filenames:
+                if filename.endswith(".java"):
+                    java_files.append(os.path.join(dirpath, filename))
+    else:
+        # Directory entries carry their type on most platforms, so no stat
+        # calls are needed
+        dirpaths = [input_path]
+
+        while dirpaths:
+            for entry in scandir(dirpaths.pop()):
+                if entry.is_dir(follow_symlinks=False):
+                    if not is_excluded(entry.path, excludes):
+                        dirpaths.append(entry.path)
+                elif entry.name.endswith(".java"):
+                    java_files.append(entry.path)
+
+    java_files.sort()
+
+    return java_files
+
+def is_archive(path):
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+def get_archive(archive_path):
+    """ Get an open ZipFile for the given archive, opening each archive only
+    once until it is modified or close_archives is called. """
+
+    st = os.stat(archive_path)
+    key = (st.st_mtime, st.st_size)
+
+    with _archives_lock:
+        cached = _archives.get(archive_path)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        if cached is not None:
+            cached[1].close()
+
+        archive = zipfile.ZipFile(archive_path)
+        _archives[archive_path] = (key, archive)
+
+    return archive
+
+def close_archives():
+    """ Close the archives opened by get_archive """
+
+    with _archives_lock:
+        for key, archive in _archives.values():
+            archive.close()
+
+        _archives.clear()
+
+def split_archive_path(source_file):
+    """ Split a source file path into the path of the archive containing it and
+    the name of the entry within the archive. Returns (source_file, None) for
+    source files which aren't within an archive. """
+
+    if ARCHIVE_SEPARATOR in source_file:
+        return source_file.split(ARCHIVE_SEPARATOR, 1)
+    else:
+        return source_file, None
+
+def find_archive_source_files(archive_path, excludes):
+    """ Get a list of paths for all Java source files within the given zip or jar
+    archive. Paths are of the form '<archive>!/<entry name>'. Excludes are
+    matched as if the archive were a directory. """
+
+    java_files = []
+
+    archive_path = os.path.normpath(os.path.abspath(archive_path))
+
+    for name in get_archive(archive_path).namelist():
+        if not name.endswith('.java'):
+            continue
+
+        dirname = name.rpartition('/')[0]
+        if is_excluded(archive_path + '/' + dirname, excludes):
             continue
 
-        for filename in filenames:
-            if filename.endswith(".java"):
-                java_files.append(os.path.join(dirpath, filename))
+        java_files.append(archive_path + ARCHIVE_SEPARATOR + name)
+
+    java_files.sort()
 
     return java_files
 
-def write_toc(packages, opts):
+def read_source(source_file):
+    archive_path, name = split_archive_path(source_file)
+
+    if name:
+        return get_archive(archive_path).read(name)
+
+    f = open(source_file)
+    source = f.read()
+    f.close()
+
+    return source
+
+def get_source_mtime(source_file):
+    """ Get the modification time of a source file, or of the archive it is
+    contained within. """
+
+    archive_path, _ = split_archive_path(source_file)
+    return os.stat(archive_path).st_mtime
+
+def find_all_source_files(input_paths, excludes, jobs=1):
+    """ Find the Java source files within each of the given directories,
+    scanning up to jobs directories in parallel. Returns a list of file lists in
+    the order of input_paths. """
+
+    def find(input_path):
+        if is_archive(input_path):
+            return find_archive_source_files(input_path, excludes)
+        else:
+            return find_source_files(input_path, excludes)
+
+    if jobs <= 1 or len(input_paths) <= 1:
+        return [find(input_path) for input_path in input_paths]
+
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(min(jobs, len(input_paths)))
+
+    try:
+        return pool.map(find, input_paths)
+    finally:
+        pool.close()
+
+def get_index_page(title, docnames, maxdepth, package=None):
+    """ Build a page with the given title and a toctree listing the given
+    documents """
+
     doc = util.Document()
-    doc.add_heading('Javadoc', '=')
+    doc.add_heading(title, '=')
+
+    if package:
+        doc.add_object(util.Directive('java:package', package))
 
     toc = util.Directive('toctree')
-    toc.add_option('maxdepth', '2')
+    toc.add_option('maxdepth', maxdepth)
     doc.add_object(toc)
 
-    packages = list(packages)
-    packages.sort()
+    for docname in docnames:
+        toc.add_content(docname + '\n')
+
+    return doc.build()
+
+def get_toc(packages):
+    """ Build the top level table of contents listing the given packages """
+
+    docnames = [package.replace('.', '/') + '/package-index' for package in sorted(packages)]
+    return get_index_page('Javadoc', docnames, '2')
+
+def get_package_index(package, filebasenames):
+    """ Build the index of a package listing the given type documents """
+
+    return get_index_page(package, sorted(filebasenames), '1', package)
+
+def split_toc(docname, title, entries, max_entries):
+    """ Split a toctree listing the given (label, docname) entries into a tree
+    of pages listing at most max_entries each. Returns a list of (docname,
+    title, entries) tuples for the pages, starting with the given docname.
+    Pages added by the split are named docname-N and titled with the labels of
+    the first and last entries below them. All docnames are relative to the
+    same directory. """
+
+    if not max_entries or len(entries) <= max_entries:
+        return [(docname, title, entries)]
+
+    pages = []
+    level = [(label, label, target) for label, target in entries]
+
+    while len(level) > max_entries:
+        next_level = []
+
+        for i in range(0, len(level), max_entries):
+            group = level[i:i + max_entries]
+            first, last = group[0][0], group[-1][1]
+            name = '%s-%d' % (docname, len(pages) + 1)
+
+            pages.append((name, '%s (%s to %s)' % (title, first, last),
+                          [(label, target) for label, _, target in group]))
+            next_level.append((first, last, name))
+
+        level = next_level
+
+    return [(docname, title, [(label, target) for label, _, target in level])] + pages
+
+def get_package_tree(packages):
+    """ Get the hierarchy of the given packages as a dict mapping each node to
+    its sorted child nodes, with '' as the root. Nodes are the packages and
+    the prefixes at which the hierarchy branches. """
+
+    packages = set(packages)
+    children = {}
+
     for package in packages:
-        toc.add_content(package.replace('.', '/') + '/package-index\n')
+        parts = package.split('.')
+
+        for i in range(len(parts)):
+            children.setdefault('.'.join(parts[:i]), set()).add('.'.join(parts[:i + 1]))
+
+    def collapse(node):
+        # Skip prefixes which neither are a package nor branch
+        while node not in packages and len(children.get(node, ())) == 1:
+            node = next(iter(children[node]))
+
+        return node
+
+    tree = {}
+    pending = ['']
+
+    while pending:
+        node = pending.pop()
+        tree[node] = sorted(collapse(child) for child in children.get(node, ()))
+        pending.extend(child for child in tree[node] if child in children)
+
+    return tree
+
+def get_max_toc_entries(opts):
+    return getattr(opts, 'max_toc_entries', None) or 0
+
+def write_index_pages(dirpath, pages, opts, package=None, maxdepth='1'):
+    """ Write the pages returned by split_toc to the given directory, removing
+    pages left over from an earlier split into more pages. Returns the paths
+    written. """
+
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+
+    paths = []
+
+    for i, (docname, title, entries) in enumerate(pages):
+        content = get_index_page(title, [target for _, target in entries], maxdepth,
+                                 package if i == 0 else None)
+        paths.append(os.path.join(dirpath, docname + '.' + opts.suffix))
+        write_file(paths[-1], content.encode('utf8'))
+
+    remove_split_pages(dirpath, pages[0][0], len(pages) - 1, opts)
+
+    return paths
+
+def remove_split_pages(dirpath, docname, num_pages, opts):
+    """ Remove the pages split_toc added to the given document beyond the
+    given number """
+
+    prefix = docname + '-'
+    suffix = '.' + opts.suffix
+
+    for filename in os.listdir(dirpath):
+        if filename.startswith(prefix) and filename.endswith(suffix):
+            number = filename[len(prefix):-len(suffix)]
 
+            if number.isdigit() and int(number) > num_pages:
+                os.remove(os.path.join(dirpath, filename))
+
+def write_package_tree(packages, opts):
+    """ Write the table of contents as a hierarchy of pages following the
+    package hierarchy, with no toctree larger than the maximum. Returns the
+    paths written. """
+
+    paths = []
+    packages = set(packages)
+    tree = get_package_tree(packages)
+    max_entries = get_max_toc_entries(opts)
+
+    for node, children in tree.items():
+        depth = len(node.split('.')) if node else 0
+        entries = []
+
+        if node in packages:
+            entries.append((node, 'package-index'))
+
+        for child in children:
+            basename = 'package-tree' if tree.get(child) else 'package-index'
+            entries.append((child, '/'.join(child.split('.')[depth:] + [basename])))
+
+        if node:
+            dirpath = os.path.join(opts.destdir, node.replace('.', os.sep))
+            pages = split_toc('package-tree', node, entries, max_entries)
+        else:
+            dirpath = opts.destdir
+            pages = split_toc('packages', 'Javadoc', entries, max_entries)
+
+        paths.extend(write_index_pages(dirpath, pages, opts))
+
+    return paths
+
+def run_git(cwd, args):
+    """ Run a git command in the given directory, returning its output """
+
+    try:
+        process = subprocess.Popen(['git'] + args, cwd=cwd,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        sys.stderr.write('git is required for --git and --since.\n')
+        sys.exit(1)
+
+    output, error = process.communicate()
+
+    if process.returncode != 0:
+        sys.stderr.write('git %s failed in %s: %s' % (' '.join(args), cwd, error))
+        sys.exit(1)
+
+    return output
+
+def find_git_source_files(input_path, excludes, since=None):
+    """ Get a list of filenames for all Java source files within the given
+    directory which are tracked by git. If since is given only files changed
+    since that revision (including uncommitted and untracked files) are
+    returned. """
+
+    input_path = os.path.normpath(os.path.abspath(input_path))
+
+    if since:
+        output = run_git(input_path, ['diff', '--name-only', '--relative', '-z', since, '--', '*.java'])
+        output += run_git(input_path, ['ls-files', '--others', '--exclude-standard', '-z', '--', '*.java'])
+    else:
+        output = run_git(input_path, ['ls-files', '-z', '--', '*.java'])
+
+    java_files = []
+
+    for filename in sorted(set(output.split('\0'))):
+        if not filename:
+            continue
+
+        path = os.path.join(input_path, filename.replace('/', os.sep))
+
+        if is_excluded(os.path.dirname(path), excludes):
+            continue
+
+        # Changed files include deleted ones
+        if since and not os.path.exists(path):
+            continue
+
+        java_files.append(path)
+
+    return java_files
+
+def find_git_deleted_files(input_path, excludes, since):
+    """ Get a list of filenames for all Java source files within the given
+    directory which were deleted, or renamed to another name, since the given
+    revision. """
+
+    input_path = os.path.normpath(os.path.abspath(input_path))
+    output = run_git(input_path, ['diff', '--name-status', '--relative', '-z', since, '--', '*.java'])
+
+    fields = output.split('\0')
+    deleted = []
+    i = 0
+
+    while i + 1 < len(fields):
+        status = fields[i]
+
+        # Renames and copies list both the old and the new name
+        if status[:1] in ('R', 'C'):
+            filenames = fields[i + 1:i + 3]
+            i += 3
+        else:
+            filenames = fields[i + 1:i + 2]
+            i += 2
+
+        if status[:1] not in ('D', 'R'):
+            continue
+
+        path = os.path.join(input_path, filenames[0].replace('/', os.sep))
+
+        if not is_excluded(os.path.dirname(path), excludes) and not os.path.exists(path):
+            deleted.append(path)
+
+    return deleted
+
+def list_package_documents(package, opts):
+    """ Get the basenames of the documents already written for the given
+    package. """
+
+    dirpath = os.path.join(opts.destdir, package.replace('.', os.sep))
+    suffix = '.' + opts.suffix
+
+    if not os.path.isdir(dirpath):
+        return []
+
+    # Index pages are the only documents named package-*, and member documents
+    # the only ones containing '--', as Java identifiers can't contain hyphens
+    return [filename[:-len(suffix)] for filename in os.listdir(dirpath)
+            if filename.endswith(suffix) and not filename.startswith('package-') and
+            '--' not in filename]
+
+def list_packages(opts):
+    """ Get the packages which already have a package index written """
+
+    packages = []
+    index_filename = 'package-index.' + opts.suffix
+
+    for dirpath, dirnames, filenames in os.walk(opts.destdir):
+        if index_filename in filenames:
+            package_path = os.path.relpath(dirpath, opts.destdir)
+            packages.append(package_path.replace(os.sep, '.'))
+
+    return packages
+
+# Temporary files are created private, while the files they replace should get
+# the permissions given by the umask, read the first time a file is written
+_umask = None
+_umask_lock = threading.Lock()
+
+def get_umask():
+    """ Return the process umask, which can only be read by setting it """
+
+    global _umask
+
+    with _umask_lock:
+        if _umask is None:
+            _umask = os.umask(0)
+            os.umask(_umask)
+
+    return _umask
+
+@contextlib.contextmanager
+def open_atomic(fullpath):
+    """ Open a file for writing by way of a temporary file in the same
+    directory, which replaces the file once closed without error. Readers such
+    as Sphinx never see the file partially written. """
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(fullpath), prefix='.tmp-')
+
+    try:
+        f = os.fdopen(fd, 'wb')
+
+        try:
+            yield f
+        finally:
+            f.close()
+
+        os.chmod(temp_path, 0666 & ~get_umask())
+
+        # Renaming onto an existing file fails on Windows
+        if os.name == 'nt' and os.path.exists(fullpath):
+            os.remove(fullpath)
+
+        os.rename(temp_path, fullpath)
+    except:
+        os.remove(temp_path)
+        raise
+
+def write_file(fullpath, data):
+    with open_atomic(fullpath) as f:
+        f.write(data)
+
+class DocumentWriter(object):
+    """ Writes files on a pool of background threads, so that writing overlaps
+    with compiling. Each thread is fed through its own bounded queue, and all
+    writes of a path go to the same thread so they happen in order. """
+
+    def __init__(self, jobs, queue_size=64):
+        self.queues = [Queue.Queue(queue_size) for _ in range(jobs)]
+        self.errors = []
+        self.threads = []
+
+        # Reading the umask briefly clears it, so do so before any thread
+        # creates files or directories
+        get_umask()
+
+        for queue in self.queues:
+            thread = threading.Thread(target=self.__work, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def __work(self, queue):
+        while True:
+            item = queue.get()
+
+            if item is None:
+                return
+
+            try:
+                write_file(*item)
+            except Exception as e:
+                self.errors.append((item[0], e))
+
+    def __check(self):
+        if self.errors:
+            fullpath, e = self.errors[0]
+            sys.stderr.write('Exception while writing ' + fullpath + '\n')
+            raise e
+
+    def write(self, fullpath, data):
+        self.__check()
+        self.queues[hash(fullpath) % len(self.queues)].put((fullpath, data))
+
+    def close(self):
+        """ Wait for all pending writes to finish """
+
+        for queue in self.queues:
+            queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.__check()
+
+def write_toc(packages, opts):
     filename = 'packages.' + opts.suffix
     fullpath = os.path.join(opts.destdir, filename)
 
@@ -55,17 +583,71 @@ def write_toc(packages, opts):
         sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
         sys.exit(1)
 
-    f = open(fullpath, 'w')
-    f.write(doc.build().encode('utf8'))
-    f.close()
+    if get_max_toc_entries(opts):
+        paths = [path for path in write_package_tree(packages, opts)
+                 if os.path.basename(path).startswith('package-tree')]
+    else:
+        paths = []
+        write_file(fullpath, get_toc(packages).encode('utf8'))
+        remove_split_pages(opts.destdir, 'packages', 0, opts)
+
+    # Remove the pages of package hierarchy nodes which no longer exist
+    tree_path = os.path.join(opts.destdir, TREE_FILENAME)
+    written = [os.path.relpath(path, opts.destdir).replace(os.sep, '/') for path in paths]
+
+    try:
+        f = open(tree_path)
+    except IOError:
+        previous = []
+    else:
+        previous = json.load(f)
+        f.close()
+
+    for path in set(previous) - set(written):
+        fullpath = os.path.join(opts.destdir, path.replace('/', os.sep))
+
+        if os.path.exists(fullpath):
+            os.remove(fullpath)
+
+    if written:
+        write_file(tree_path, json.dumps(sorted(written)))
+    elif os.path.exists(tree_path):
+        os.remove(tree_path)
+
+def remove_member_pages(dirpath, filenames, filebasename, member_basenames, opts):
+    """ Remove the member documents of the given type's document other than
+    the given ones, given the filenames within its directory """
+
+    prefix = filebasename + '--'
+    suffix = '.' + opts.suffix
+
+    for filename in filenames:
+        if (filename.startswith(prefix) and filename.endswith(suffix) and
+            filename[:-len(suffix)] not in member_basenames):
+            os.remove(os.path.join(dirpath, filename))
+
+def write_documents(documents, sources, opts, writer=None, listings=None):
+    """ Write the given documents, returning the basenames of their files by
+    package. The files are written by the given DocumentWriter if any, or
+    before returning otherwise.
+
+    If a dict is given for listings, member documents of the written types
+    which are no longer generated are removed. It caches the listing of each
+    directory, and can be shared between calls so each is only listed once.
+
+    """
 
-def write_documents(documents, sources, opts):
     package_contents = dict()
+    member_basenames = dict()
+
+    for package, name, document in documents.values():
+        if '#' in name:
+            member_basenames.setdefault(package, set()).add(name.replace('.', '-').replace('#', '--'))
 
     # Write individual documents
     for fullname, (package, name, document) in documents.items():
         package_path = package.replace('.', os.sep)
-        filebasename = name.replace('.', '-')
+        filebasename = name.replace('.', '-').replace('#', '--')
         filename = filebasename + '.' + opts.suffix
         dirpath = os.path.join(opts.destdir, package_path)
         fullpath = os.path.join(dirpath, filename)
@@ -76,37 +658,41 @@ def write_documents(documents, sources, opts):
             sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
             sys.exit(1)
 
-        # Add to package indexes
-        package_contents.setdefault(package, list()).append(filebasename)
+        # Add to package indexes, except for member documents which are
+        # linked from their type's document
+        if '#' in name:
+            package_contents.setdefault(package, list())
+        else:
+            package_contents.setdefault(package, list()).append(filebasename)
+
+            if listings is not None:
+                if dirpath not in listings:
+                    listings[dirpath] = os.listdir(dirpath)
+
+                remove_member_pages(dirpath, listings[dirpath], filebasename,
+                                    member_basenames.get(package, ()), opts)
 
         if opts.update and os.path.exists(fullpath):
             # If the destination file is newer than the source file than skip
             # writing it out
-            source_mod_time = os.stat(sources[fullname]).st_mtime
+            source_mod_time = get_source_mtime(sources[fullname])
             dest_mod_time = os.stat(fullpath).st_mtime
 
             if source_mod_time < dest_mod_time:
                 continue
 
-        f = open(fullpath, 'w')
-        f.write(document.encode('utf8'))
-        f.close()
-
-    # Write package-index for each package
-    for package, index in package_contents.items():
-        doc = util.Document()
-        doc.add_heading(package, '=')
+        if writer:
+            writer.write(fullpath, document.encode('utf8'))
+        else:
+            write_file(fullpath, document.encode('utf8'))
 
-        doc.add_object(util.Directive('java:package', package))
+    return package_contents
 
-        toc = util.Directive('toctree')
-        toc.add_option('maxdepth', '1')
-        doc.add_object(toc)
-
-        index.sort()
-        for filebasename in index:
-            toc.add_content(filebasename + '\n')
+def write_package_indexes(package_contents, opts):
+    """ Write package-index for each package, split into several pages if
+    --max-toc-entries is exceeded """
 
+    for package, index in package_contents.items():
         package_path = package.replace('.', os.sep)
         filename = 'package-index.' + opts.suffix
         dirpath = os.path.join(opts.destdir, package_path)
@@ -118,73 +704,286 @@ def write_documents(documents, sources, opts):
             sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
             sys.exit(1)
 
-        f = open(fullpath, 'w')
-        f.write(doc.build().encode('utf8'))
+        entries = [(filebasename, filebasename) for filebasename in sorted(index)]
+        pages = split_toc('package-index', package, entries, get_max_toc_entries(opts))
+        write_index_pages(dirpath, pages, opts, package)
+
+def update_package_indexes(package_contents, opts):
+    """ Rewrite the indexes of the given packages only, listing both the new
+    and the previously written documents. Packages left without documents
+    lose their index. The table of contents is only rewritten when a package
+    appears or disappears. """
+
+    new_packages = [package for package in package_contents
+                    if not os.path.exists(os.path.join(opts.destdir, package.replace('.', os.sep),
+                                                       'package-index.' + opts.suffix))]
+    removed_packages = []
+
+    for package, index in package_contents.items():
+        index = list(set(index) | set(list_package_documents(package, opts)))
+
+        if index:
+            package_contents[package] = index
+            continue
+
+        del package_contents[package]
+
+        if package not in new_packages:
+            dirpath = os.path.join(opts.destdir, package.replace('.', os.sep))
+            os.remove(os.path.join(dirpath, 'package-index.' + opts.suffix))
+            remove_split_pages(dirpath, 'package-index', 0, opts)
+            removed_packages.append(package)
+
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+    write_package_indexes(package_contents, opts)
+
+    if not opts.notoc and (new_packages or removed_packages):
+        write_toc(list_packages(opts), opts)
+
+def get_source_key(source_file):
+    return os.path.abspath(source_file)
+
+def read_source_map(opts):
+    """ Read the map from source files to the paths of the documents written
+    for them, relative to the output directory and without suffix. Returns
+    None if there is none. """
+
+    try:
+        f = open(os.path.join(opts.destdir, SOURCES_FILENAME))
+    except IOError:
+        return None
+
+    source_map = json.load(f)
+    f.close()
+
+    return source_map
+
+def write_source_map(source_map, opts):
+    write_file(os.path.join(opts.destdir, SOURCES_FILENAME), json.dumps(source_map, sort_keys=True))
+
+def remove_stale_documents(source_map, source_documents, deleted_files, opts):
+    """ Remove the documents previously written for the given regenerated and
+    deleted source files which are no longer generated, and update the source
+    map accordingly. Returns the packages documents were removed from. """
+
+    packages = set()
+    stale = dict((get_source_key(source_file), []) for source_file in deleted_files)
+    stale.update(source_documents)
+
+    for source_key, document_paths in stale.items():
+        for document_path in set(source_map.get(source_key, [])) - set(document_paths):
+            fullpath = os.path.join(opts.destdir, document_path.replace('/', os.sep) + '.' + opts.suffix)
+
+            if os.path.exists(fullpath):
+                os.remove(fullpath)
+
+            packages.add(document_path.rpartition('/')[0].replace('/', '.'))
+
+        if document_paths:
+            source_map[source_key] = document_paths
+        else:
+            source_map.pop(source_key, None)
+
+    return packages
+
+def write_manifest(package_contents, source_documents, opts):
+    """ Write the partial package contents and source map of a shard, to be
+    merged once all shards are complete. """
+
+    shard, num_shards = opts.shard
+    filename = MANIFEST_FILENAME % (shard, num_shards)
+
+    manifest = {'shard': shard, 'shards': num_shards, 'packages': package_contents,
+                'sources': source_documents}
+    write_file(os.path.join(opts.destdir, filename), json.dumps(manifest, sort_keys=True))
+
+def merge_manifests(opts):
+    """ Merge the manifests of all shards in the output directory, returning the
+    complete package contents and source map. The manifests are removed
+    afterwards. """
+
+    manifest_files = glob.glob(os.path.join(opts.destdir, MANIFEST_FILENAME.replace('%d', '*')))
+
+    if not manifest_files:
+        sys.stderr.write('No shard manifests found in %s.\n' % (opts.destdir,))
+        sys.exit(1)
+
+    package_contents = dict()
+    source_map = dict()
+    shards = set()
+    num_shards = None
+
+    for manifest_file in manifest_files:
+        f = open(manifest_file)
+        manifest = json.load(f)
         f.close()
 
-def get_newer(a, b):
-    if not os.path.exists(a):
-        return b
+        if num_shards is not None and manifest['shards'] != num_shards:
+            sys.stderr.write('%s belongs to a run with a different number of shards.\n' % (manifest_file,))
+            sys.exit(1)
+
+        num_shards = manifest['shards']
+        shards.add(manifest['shard'])
+
+        for package, index in manifest['packages'].items():
+            package_contents.setdefault(package, list()).extend(index)
+
+        source_map.update(manifest['sources'])
+
+    missing = set(range(1, num_shards + 1)) - shards
+    if missing:
+        sys.stderr.write('Missing manifests for shards %s of %d.\n' % (', '.join(str(k) for k in sorted(missing)), num_shards))
+        sys.exit(1)
 
-    if not os.path.exists(b):
-        return a
+    for manifest_file in manifest_files:
+        os.remove(manifest_file)
 
-    a_mtime = int(os.stat(a).st_mtime)
-    b_mtime = int(os.stat(b).st_mtime)
+    return package_contents, source_map
+
+def select_shard(input_path, source_files, shard, num_shards):
+    """ Select the source files belonging to the given shard. Files are
+    partitioned by a hash of their path relative to the input path, so all
+    machines agree on the partitioning. """
+
+    input_path = os.path.normpath(os.path.abspath(input_path))
+    selected = []
+
+    for source_file in source_files:
+        _, relpath = split_archive_path(source_file)
 
-    if a_mtime < b_mtime:
-        return b
+        if not relpath:
+            relpath = os.path.relpath(source_file, input_path).replace(os.sep, '/')
 
-    return a
+        if int(hashlib.md5(relpath).hexdigest(), 16) % num_shards == shard - 1:
+            selected.append(source_file)
 
-def generate_from_source_file(doc_compiler, source_file, cache_dir):
-    if cache_dir:
-        cache_file = os.path.join(cache_dir, source_file.replace(os.sep, ':')) + '-CACHE'
+    return selected
 
-        if get_newer(source_file, cache_file) == cache_file:
-            return pickle.load(open(cache_file))
+def parse_shard(value):
+    """ Parse a K/N shard specification into a (K, N) tuple """
+
+    try:
+        shard, num_shards = [int(n) for n in value.split('/')]
+    except ValueError:
+        return None
+
+    if not 1 <= shard <= num_shards:
+        return None
+
+    return shard, num_shards
+
+def write_model(packages, documents, sources, opts):
+    """ Write the models of all documented types as a stream of records, one
+    per package and one per type. JSON records are written one per line. """
+
+    if opts.format == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            sys.stderr.write('The msgpack package is required for msgpack output.\n')
+            sys.exit(1)
+
+        encode = msgpack.packb
     else:
-        cache_file = None
+        encode = lambda record: json.dumps(record, sort_keys=True) + '\n'
 
-    f = open(source_file)
-    source = f.read()
-    f.close()
+    fullpath = os.path.join(opts.destdir, 'api.' + MODEL_SUFFIXES[opts.format])
+
+    if os.path.exists(fullpath) and not (opts.force or opts.update):
+        sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
+        sys.exit(1)
+
+    with open_atomic(fullpath) as f:
+        for package in sorted(packages):
+            f.write(encode({'kind': 'package', 'name': package}))
+
+        for fullname in sorted(documents):
+            _, _, model = documents[fullname]
+            record = dict(model, source=sources[fullname])
+            f.write(encode(record))
+
+def generate_from_source_file(doc_compiler, source_file, source_cache, profiler, ast_cache=None):
+    source = None
+
+    if source_cache:
+        archive_path, name = split_archive_path(source_file)
+
+        if name:
+            # Archive entries are keyed by their CRC, so they don't need to be
+            # read unless they must be compiled
+            info = get_archive(archive_path).getinfo(name)
+            content_id = 'zip:%s:%08x:%d' % (name, info.CRC, info.file_size)
+        else:
+            content_id = source = read_source(source_file)
+
+        cache_key = source_cache.get_key(content_id, doc_compiler.cache_tag)
+
+        with profiler.stage('cache'):
+            documents = source_cache.load(cache_key)
+
+        if documents is not None:
+            return documents
+
+    if source is None:
+        source = read_source(source_file)
 
     try:
-        ast = javalang.parse.parse(source)
+        with profiler.stage('parse'):
+            if ast_cache:
+                ast = ast_cache.parse(source, source_file)
+            else:
+                ast = javalang.parse.parse(source)
     except Exception:
         sys.stderr.write('Exception while parsing ' + source_file + '\n')
         raise
 
     try:
-        documents = doc_compiler.compile(ast)
+        with profiler.stage('compile'):
+            documents = doc_compiler.compile(ast)
     except Exception:
         sys.stderr.write('Exception while compiling ' + source_file + '\n')
         raise
 
-    if cache_file:
-        dump_file = open(cache_file, 'w')
-        pickle.dump(documents, dump_file)
-        dump_file.close()
+    if source_cache:
+        with profiler.stage('cache'):
+            source_cache.store(cache_key, documents)
 
     return documents
 
-def generate_documents(source_files, cache_dir, verbose):
+def generate_documents(source_files, source_cache, verbose, doc_compiler=None, profiler=None,
+                       ast_cache=None, on_documents=None):
+    """ Compile the given source files. Returns the set of packages and dicts
+    mapping the full names of types to their documents and source files. If
+    given, on_documents is called with each source file and its documents as
+    soon as it is compiled. """
+
     documents = {}
     sources = {}
-    doc_compiler = compiler.JavadocRestCompiler()
+
+    if profiler is None:
+        profiler = profiling.NullProfiler()
+
+    if doc_compiler is None:
+        doc_compiler = compiler.JavadocRestCompiler(profiler=profiler)
 
     for source_file in source_files:
         if verbose:
             print 'Processing', source_file
 
-        this_file_documents = generate_from_source_file(doc_compiler, source_file, cache_dir)
+        with profiler.source(source_file):
+            this_file_documents = generate_from_source_file(doc_compiler, source_file, source_cache,
+                                                            profiler, ast_cache)
 
         for fullname in this_file_documents:
             sources[fullname] = source_file
 
         documents.update(this_file_documents)
 
+        if on_documents:
+            on_documents(source_file, this_file_documents)
+
     packages = set()
 
     for package, _, _ in documents.values():
@@ -192,35 +991,151 @@ def generate_documents(source_files, cache_dir, verbose):
 
     return packages, documents, sources
 
-def normalize_excludes(rootpath, excludes):
-    f_excludes = []
-    for exclude in excludes:
-        if not os.path.isabs(exclude) and not exclude.startswith(rootpath):
-            exclude = os.path.join(rootpath, exclude)
-        f_excludes.append(os.path.normpath(exclude) + os.path.sep)
-    return f_excludes
-
-def is_excluded(root, excludes):
-    sep = os.path.sep
-    if not root.endswith(sep):
-        root += sep
+def glob_to_regex(pattern):
+    """ Translate a glob pattern to a regular expression. '*' and '?' don't
+    match path separators, '**' matches any number of path components. """
+
+    parts = re.split(r'(\*\*/?|\*|\?)', pattern)
+    regex = []
+
+    for part in parts:
+        if part in ('**', '**/'):
+            regex.append('(?:.*/)?' if part == '**/' else '.*')
+        elif part == '*':
+            regex.append('[^/]*')
+        elif part == '?':
+            regex.append('[^/]')
+        else:
+            regex.append(re.escape(part))
+
+    return ''.join(regex)
+
+def compile_excludes(rootpath, excludes):
+    """ Compile exclude patterns into a single regular expression matching the
+    absolute paths of excluded directories, using '/' as the separator.
+
+    Absolute paths exclude the directory they name. Patterns prefixed with
+    'glob:' are glob patterns, all other patterns (optionally prefixed with
+    're:') are regular expressions. Relative patterns must match from the
+    beginning of the path relative to rootpath and up to a path separator.
+
+    """
+
+    if not excludes:
+        return None
+
+    # Relative excludes may also be given including rootpath itself
+    given_prefix = os.path.normpath(rootpath).replace(os.sep, '/') + '/'
+
+    rootpath = os.path.normpath(os.path.abspath(rootpath)).replace(os.sep, '/')
+    root_prefix = re.escape(rootpath.rstrip('/') + '/')
+    regexes = []
+
     for exclude in excludes:
-        if root.startswith(exclude):
-            return True
-    return False
+        if exclude.startswith('glob:'):
+            regex = root_prefix + glob_to_regex(exclude[5:])
+        elif exclude.startswith('re:'):
+            regex = root_prefix + exclude[3:]
+        elif os.path.isabs(exclude):
+            regex = re.escape(os.path.normpath(exclude).replace(os.sep, '/'))
+        else:
+            # Plain paths are normalized like absolute ones, e.g. dropping the
+            # trailing separator added by shell completion
+            if not re.search(r'[\\^$|?*+()\[\]{}]', exclude):
+                exclude = os.path.normpath(exclude).replace(os.sep, '/')
+            else:
+                exclude = exclude.rstrip('/')
+
+            if exclude.startswith(given_prefix):
+                exclude = exclude[len(given_prefix):]
+
+            regex = root_prefix + exclude
+
+        regexes.append('(?:%s)(?:/|$)' % (regex,))
+
+    return re.compile('|'.join(regexes))
+
+def is_excluded(path, excludes):
+    if excludes is None:
+        return False
+
+    if os.sep != '/':
+        path = path.replace(os.sep, '/')
+
+    return excludes.match(path) is not None
+
+def merge_main(argv):
+    parser = OptionParser(
+        usage="""\
+usage: %prog merge [options] -o <output_path>
+
+Merge the partial package manifests written to <output_path> by runs using
+--shard into the package indexes and table of contents, producing the same
+output as a single run over all sources.""")
+
+    parser.add_option('-o', '--output-dir', action='store', dest='destdir',
+                      help='Directory containing the output of all shards', default='')
+    parser.add_option('-f', '--force', action='store_true', dest='force',
+                      help='Overwrite all files')
+    parser.add_option('-u', '--update', action='store_true', dest='update',
+                      help='Overwrite new and changed files', default=False)
+    parser.add_option('-T', '--no-toc', action='store_true', dest='notoc',
+                      help='Don\'t create a table of contents file')
+    parser.add_option('-s', '--suffix', action='store', dest='suffix',
+                      help='file suffix (default: rst)', default='rst')
+    parser.add_option('--max-toc-entries', action='store', dest='max_toc_entries', type='int',
+                      help='Nest the table of contents by package hierarchy and split package '
+                      'indexes so that no toctree lists more than this many entries')
+
+    (opts, args) = parser.parse_args(argv[2:])
+
+    if not opts.destdir:
+        parser.error('An output directory is required.')
+
+    if opts.suffix.startswith('.'):
+        opts.suffix = opts.suffix[1:]
+
+    if opts.max_toc_entries is not None and opts.max_toc_entries < 2:
+        parser.error('--max-toc-entries must be at least 2.')
+
+    package_contents, source_map = merge_manifests(opts)
+
+    write_package_indexes(package_contents, opts)
+    write_source_map(source_map, opts)
+
+    if not opts.notoc:
+        write_toc(package_contents.keys(), opts)
 
 def main(argv=sys.argv):
+    if len(argv) > 1 and argv[1] == 'merge':
+        return merge_main(argv)
+
+    if len(argv) > 1 and argv[1] in ('serve', 'client'):
+        import server
+
+        if argv[1] == 'serve':
+            return server.serve_main(argv)
+        else:
+            return server.client_main(argv)
+
     parser = OptionParser(
         usage="""\
 usage: %prog [options] -o <output_path> <input_path> [exclude_paths, ...]
 
-Look recursively in <input_path> for Java sources files and create reST files
+Look recursively in <input_path> (a directory, or a zip or jar archive such as
+a -sources.jar) for Java sources files and create reST files
 for all non-private classes, organized by package under <output_path>. A package
 index (package-index.<ext>) will be created for each package, and a top level
 table of contents will be generated named packages.<ext>.
 
 Paths matching any of the given exclude_paths (interpreted as regular
-expressions) will be skipped.
+expressions relative to <input_path>, or as glob patterns if prefixed with
+'glob:') will be skipped.
+
+Generation can be split across several runs using --shard K/N. Each shard
+writes its type documents and a partial package manifest, and
+'%prog merge -o <output_path>' then writes the package indexes and table of
+contents once the output of all shards has been collected.
 
 Note: By default this script will not overwrite already created files.""")
 
@@ -230,14 +1145,40 @@ Note: By default this script will not overwrite already created files.""")
                       help='Overwrite all files')
     parser.add_option('-c', '--cache-dir', action='store', dest='cache_dir',
                       help='Directory to stored cachable output')
+    parser.add_option('--shared-cache-dir', action='store', dest='shared_cache_dir',
+                      help='Read-only cache directory to check after the cache directory')
     parser.add_option('-u', '--update', action='store_true', dest='update',
                       help='Overwrite new and changed files', default=False)
     parser.add_option('-T', '--no-toc', action='store_true', dest='notoc',
                       help='Don\'t create a table of contents file')
     parser.add_option('-s', '--suffix', action='store', dest='suffix',
                       help='file suffix (default: rst)', default='rst')
+    parser.add_option('--max-toc-entries', action='store', dest='max_toc_entries', type='int',
+                      help='Nest the table of contents by package hierarchy and split package '
+                      'indexes so that no toctree lists more than this many entries')
+    parser.add_option('-F', '--format', action='store', dest='format', type='choice',
+                      choices=['rst', 'json', 'msgpack'], default='rst',
+                      help='output format, one of rst, json or msgpack (default: rst)')
+    parser.add_option('--member-pages', action='store', dest='member_pages', type='int', default=0,
+                      help='Document the members of types with more than this many fields, '
+                      'constructors and methods on separate pages')
     parser.add_option('-I', '--include', action='append', dest='includes',
                       help='Additional input paths to scan', default=[])
+    parser.add_option('-j', '--scan-jobs', action='store', dest='scan_jobs', type='int',
+                      help='Number of input paths to scan in parallel (default: 1)', default=1)
+    parser.add_option('--shard', action='store', dest='shard',
+                      help='Only process shard K of N (given as K/N)')
+    parser.add_option('--git', action='store_true', dest='git',
+                      help='Only process source files tracked by git')
+    parser.add_option('--since', action='store', dest='since',
+                      help='Only process source files changed since the given git revision')
+    parser.add_option('--write-jobs', type='int', dest='write_jobs', default=4,
+                      help='Number of threads writing documents while sources are compiled, 0 to '
+                      'write them from the main thread (default: 4)')
+    parser.add_option('--profile', action='store', dest='profile',
+                      help='Write a JSON report of the time spent in each stage to the given file')
+    parser.add_option('--trace-memory', action='store', dest='trace_memory',
+                      help='Write a JSON report of the memory used by each stage to the given file')
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose',
                       help='verbose output')
 
@@ -257,26 +1198,178 @@ Note: By default this script will not overwrite already created files.""")
     if opts.suffix.startswith('.'):
         opts.suffix = opts.suffix[1:]
 
+    if opts.max_toc_entries is not None and opts.max_toc_entries < 2:
+        parser.error('--max-toc-entries must be at least 2.')
+
+    if opts.shard:
+        opts.shard = parse_shard(opts.shard)
+
+        if not opts.shard:
+            parser.error('--shard must be given as K/N with 1 <= K <= N.')
+
+        if opts.format != 'rst':
+            parser.error('--shard is only supported for rst output.')
+
+    if opts.since:
+        if opts.format != 'rst' or opts.shard:
+            parser.error('--since is only supported for unsharded rst output.')
+
+        # Documents of changed sources must be overwritten
+        opts.update = True
+
+    if opts.trace_memory and profiling.tracemalloc is None and profiling.resource is None:
+        parser.error('--trace-memory requires the tracemalloc or resource module.')
+
     for input_path in input_paths:
-        if not os.path.isdir(input_path):
-            sys.stderr.write('%s is not a directory.\n' % (input_path,))
+        if not os.path.isdir(input_path) and not is_archive(input_path):
+            sys.stderr.write('%s is not a directory or archive.\n' % (input_path,))
             sys.exit(1)
 
+        if (opts.git or opts.since) and not os.path.isdir(input_path):
+            parser.error('--git and --since can\'t be used with archives.')
+
     if not os.path.isdir(opts.destdir):
         os.makedirs(opts.destdir)
 
     if opts.cache_dir and not os.path.isdir(opts.cache_dir):
         os.makedirs(opts.cache_dir)
 
-    excludes = normalize_excludes(rootpath, excludes)
+    if opts.cache_dir or opts.shared_cache_dir:
+        source_cache = cache.SourceCache(opts.cache_dir, opts.shared_cache_dir)
+    else:
+        source_cache = None
+
+    excludes = compile_excludes(rootpath, excludes)
+
+    if opts.profile:
+        profiler = profiling.Profiler()
+    else:
+        profiler = profiling.NullProfiler()
+
+    if opts.trace_memory:
+        tracer = profiling.MemoryTracer()
+    else:
+        tracer = profiling.NullMemoryTracer()
+
+    try:
+        run(opts, input_paths, excludes, source_cache, profiler, tracer)
+    finally:
+        close_archives()
+
+    tracer.snapshot('write')
+
+    if source_cache and opts.verbose:
+        print source_cache.report()
+
+    if opts.profile:
+        profiler.write_report(opts.profile, source_cache)
+
+    if opts.trace_memory:
+        tracer.write_report(opts.trace_memory, source_cache)
+
+def run(opts, input_paths, excludes, source_cache, profiler, tracer):
     source_files = []
 
-    for input_path in input_paths:
-        source_files.extend(find_source_files(input_path, excludes))
+    with profiler.stage('discovery'):
+        if opts.git or opts.since:
+            all_input_files = [find_git_source_files(input_path, excludes, opts.since)
+                               for input_path in input_paths]
+        else:
+            all_input_files = find_all_source_files(input_paths, excludes, opts.scan_jobs)
 
-    packages, documents, sources = generate_documents(source_files, opts.cache_dir, opts.verbose)
+    for input_path, input_files in zip(input_paths, all_input_files):
+        if opts.shard:
+            input_files = select_shard(input_path, input_files, *opts.shard)
 
-    write_documents(documents, sources, opts)
+        source_files.extend(input_files)
 
-    if not opts.notoc:
-        write_toc(packages, opts)
+    tracer.snapshot('discovery')
+
+    package_contents = {}
+    source_documents = {}
+    writer = None
+    on_documents = None
+
+    if opts.format != 'rst':
+        doc_compiler = compiler.JavadocModelCompiler(profiler=profiler)
+    else:
+        doc_compiler = compiler.JavadocRestCompiler(profiler=profiler, member_pages=opts.member_pages)
+        written = set()
+        source_map = read_source_map(opts)
+
+        # Member pages of earlier runs are only looked for if there may be any
+        if opts.member_pages or source_map is None or any(
+            '--' in path for paths in source_map.values() for path in paths):
+            listings = {}
+        else:
+            listings = None
+
+        if opts.write_jobs > 0:
+            writer = DocumentWriter(opts.write_jobs)
+
+        def on_documents(source_file, this_file_documents):
+            # Write each file's documents while the following files compile. A
+            # type declared by several files is written for the first only.
+            new_documents = dict((fullname, value) for fullname, value in this_file_documents.items()
+                                 if fullname not in written)
+            written.update(new_documents)
+
+            sources = dict.fromkeys(new_documents, source_file)
+
+            with profiler.stage('write'):
+                written_contents = write_documents(new_documents, sources, opts, writer, listings)
+
+            for package, index in written_contents.items():
+                package_contents.setdefault(package, list()).extend(index)
+
+            source_documents[get_source_key(source_file)] = sorted(
+                '/'.join(package.split('.') + [name.replace('.', '-').replace('#', '--')])
+                for package, name, _ in new_documents.values())
+
+    try:
+        packages, documents, sources = generate_documents(source_files, source_cache, opts.verbose,
+                                                          doc_compiler, profiler, None, on_documents)
+    finally:
+        if writer:
+            # Waits for the remaining writes
+            with profiler.stage('write'):
+                writer.close()
+
+    tracer.snapshot('generate')
+    tracer.measure('documents', documents)
+    tracer.measure('sources', sources)
+
+    with profiler.stage('write'):
+        if opts.format != 'rst':
+            write_model(packages, documents, sources, opts)
+            return
+
+        if opts.shard:
+            write_manifest(package_contents, source_documents, opts)
+            return
+
+        if opts.since:
+            deleted_files = []
+            for input_path in input_paths:
+                deleted_files.extend(find_git_deleted_files(input_path, excludes, opts.since))
+
+            if source_map is None:
+                if deleted_files:
+                    sys.stderr.write('No %s in %s, documents of deleted sources are not removed.\n' %
+                                     (SOURCES_FILENAME, opts.destdir))
+            else:
+                for package in remove_stale_documents(source_map, source_documents, deleted_files, opts):
+                    package_contents.setdefault(package, list())
+
+                write_source_map(source_map, opts)
+
+            if package_contents:
+                update_package_indexes(package_contents, opts)
+
+            return
+
+        write_package_indexes(package_contents, opts)
+        write_source_map(source_documents, opts)
+
+        if not opts.notoc:
+            write_toc(packages, opts)
@@ -0,0 +1,224 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Generate documentation from Java sources while Sphinx is running, without
+the intermediate reST files written by javasphinx-apidoc.
+
+"""
+
+import hashlib
+import os
+
+from docutils import nodes
+from docutils.parsers.rst import Directive
+from docutils.statemachine import ViewList, string2lines
+
+import apidoc
+import cache
+import compiler
+import extdoc
+import profiling
+import util
+
+javalang = util.LazyModule('javalang')
+
+_doc_compilers = {}
+_source_caches = {}
+
+def get_compiler(compiler_class=compiler.JavadocRestCompiler):
+    doc_compiler = _doc_compilers.get(compiler_class)
+
+    if doc_compiler is None:
+        doc_compiler = _doc_compilers[compiler_class] = compiler_class()
+
+    return doc_compiler
+
+def find_type_source(env, fullname):
+    """ Find the source file declaring the given type within the directories
+    listed in javasphinx_source_paths. Nested types are looked for in the file
+    of their outermost type. """
+
+    package, cls = extdoc.split_name(fullname)
+
+    if not cls:
+        return None
+
+    parts = package.split('.') if package else []
+    parts.append(cls.partition('.')[0] + '.java')
+    relpath = os.path.join(*parts)
+
+    for source_path in env.config.javasphinx_source_paths:
+        path = os.path.join(env.srcdir, source_path, relpath)
+
+        if os.path.isfile(path):
+            return os.path.normpath(path)
+
+    return None
+
+def get_source_cache(env):
+    """ Get the cache of compiled sources for the environment. It is kept in a
+    directory next to the doctrees rather than in the pickled environment. """
+
+    cache_dir = os.path.join(env.doctreedir, 'javasphinx')
+    source_cache = _source_caches.get(cache_dir)
+
+    if source_cache is None:
+        source_cache = _source_caches[cache_dir] = cache.SourceCache(cache_dir, memory_entries=64)
+
+    return source_cache
+
+def get_documents(env, source_file, doc_compiler=None):
+    """ Compile the documents of the given source file. The result is cached
+    and reused for as long as the file's contents are unchanged. """
+
+    if doc_compiler is None:
+        doc_compiler = get_compiler()
+
+    return apidoc.generate_from_source_file(doc_compiler, source_file, get_source_cache(env),
+                                            profiling.NullProfiler())
+
+class JavaAutoType(Directive):
+    """
+    Directive to document a type and its members from its source file.
+    """
+
+    has_content = False
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = False
+    option_spec = {}
+
+    def run(self):
+        env = self.state.document.settings.env
+        fullname = self.arguments[0].strip()
+
+        source_file = find_type_source(env, fullname)
+
+        if not source_file:
+            raise self.error('no source found for %s in javasphinx_source_paths' % (fullname,))
+
+        env.note_dependency(source_file)
+
+        try:
+            documents = get_documents(env, source_file, get_compiler(compiler.JavadocBodyCompiler))
+        except javalang.parser.JavaSyntaxError:
+            raise self.error('syntax error in %s' % (source_file,))
+
+        if fullname not in documents:
+            raise self.error('%s is not documented in %s' % (fullname, source_file))
+
+        _, _, document = documents[fullname]
+
+        content = ViewList()
+        for i, line in enumerate(string2lines(document, convert_whitespace=True)):
+            content.append(line, source_file, i)
+
+        # The generated imports and package only apply to the type, so the
+        # context of the current document is restored afterwards
+        saved = dict((key, env.temp_data.get(key))
+                     for key in ('java:package', 'java:imports', 'java:outertype'))
+        env.temp_data.pop('java:imports', None)
+        env.temp_data.pop('java:outertype', None)
+
+        node = nodes.container()
+
+        try:
+            self.state.nested_parse(content, 0, node)
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    env.temp_data.pop(key, None)
+                else:
+                    env.temp_data[key] = value
+
+        return node.children
+
+# ------------------------------------------------------------------------------
+# ---- Virtual javasphinx-apidoc documents ----
+
+def generate_virtual_documents(app):
+    """ Compile the complete javasphinx-apidoc document set for the sources in
+    javasphinx_source_paths, to be placed below javasphinx_apidoc_dir.
+
+    Sphinx only reads documents which exist as files within the source
+    directory, so an empty placeholder file is kept for each generated
+    document. Their content is provided through the source-read event.
+
+    """
+
+    env = app.env
+    apidoc_dir = env.config.javasphinx_apidoc_dir
+
+    if not apidoc_dir:
+        return
+
+    documents = {}
+    package_contents = {}
+
+    for source_path in env.config.javasphinx_source_paths:
+        input_path = os.path.join(env.srcdir, source_path)
+
+        for source_file in apidoc.find_source_files(input_path, None):
+            for fullname, (package, name, document) in get_documents(env, source_file).items():
+                filebasename = name.replace('.', '-')
+                package_contents.setdefault(package, list()).append(filebasename)
+
+                docname = '/'.join([apidoc_dir] + package.split('.') + [filebasename])
+                documents[docname] = document
+
+    for package, index in package_contents.items():
+        docname = '/'.join([apidoc_dir] + package.split('.') + ['package-index'])
+        documents[docname] = apidoc.get_package_index(package, index)
+
+    documents[apidoc_dir + '/packages'] = apidoc.get_toc(package_contents.keys())
+
+    hashes = dict((docname, hashlib.sha1(document.encode('utf8')).hexdigest())
+                  for docname, document in documents.items())
+
+    # Remove the placeholders of documents no longer generated, and create
+    # those of new ones
+    for docname in getattr(env, 'javasphinx_virtual_hashes', {}):
+        path = env.doc2path(docname)
+
+        if docname not in documents and os.path.isfile(path) and not os.path.getsize(path):
+            os.remove(path)
+
+    for docname in documents:
+        path = env.doc2path(docname)
+
+        if not os.path.exists(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            open(path, 'w').close()
+
+    app.javasphinx_virtual_documents = documents
+    app.javasphinx_virtual_hashes = hashes
+
+def get_outdated_virtual_documents(app, env, added, changed, removed):
+    """ Report generated documents as changed when their content hash differs
+    from the one recorded when they were last read. """
+
+    hashes = getattr(app, 'javasphinx_virtual_hashes', None)
+
+    if hashes is None:
+        return []
+
+    old_hashes = getattr(env, 'javasphinx_virtual_hashes', {})
+    env.javasphinx_virtual_hashes = hashes
+
+    return [docname for docname, digest in hashes.items()
+            if docname not in added and old_hashes.get(docname) != digest]
+
+def read_virtual_document(app, docname, source):
+    documents = getattr(app, 'javasphinx_virtual_documents', None)
+
+    if documents and docname in documents:
+        source[0] = documents[docname]
+
+def close_source_archives(app, exception):
+    """ Close the source archives read during the build, so a long-lived
+    process doesn't keep them open. """
+
+    apidoc.close_archives()
@@ -0,0 +1,213 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Content addressed cache of compiled source files.
+
+"""
+
+import cPickle as pickle
+
+import collections
+import hashlib
+import os
+import tempfile
+
+import util
+
+javalang = util.LazyModule('javalang')
+
+# Rough ratio of the memory used by a parsed compilation unit to the length
+# of its source, measured with javalang 0.9. Sources made up mostly of Javadoc
+# use less.
+AST_SIZE_FACTOR = 40
+
+class SourceCache(object):
+    """ Cache of compiled source files, keyed by a hash of their contents.
+
+    Entries are looked up in a writable local directory first and then in an
+    optional read-only shared directory, e.g. one populated by CI. Entries found
+    in the shared directory are copied to the local one.
+
+    Long running processes can also keep up to memory_entries of the most
+    recently used entries in memory, which are checked before either
+    directory.
+
+    """
+
+    def __init__(self, local_dir=None, shared_dir=None, memory_entries=0):
+        self.local_dir = local_dir
+        self.shared_dir = shared_dir
+        self.memory_entries = memory_entries
+        self.memory = collections.OrderedDict()
+
+        self.hits = {'memory': 0, 'local': 0, 'shared': 0}
+        self.misses = 0
+
+        # Size of the pickled entries loaded and stored
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def get_key(self, source, tag):
+        """ Get the key for the given source contents as compiled by a compiler
+        with the given cache tag. """
+
+        return hashlib.sha1(tag + '\0' + source).hexdigest()
+
+    def __path(self, directory, key):
+        return os.path.join(directory, key[:2], key[2:])
+
+    def __write(self, directory, key, data):
+        path = self.__path(directory, key)
+        dirpath = os.path.dirname(path)
+
+        if not os.path.isdir(dirpath):
+            try:
+                os.makedirs(dirpath)
+            except OSError:
+                # Created concurrently by another process
+                pass
+
+        # Write to a temporary file first so concurrent readers never see a
+        # partial entry
+        fd, temp_path = tempfile.mkstemp(dir=dirpath)
+        f = os.fdopen(fd, 'wb')
+        f.write(data)
+        f.close()
+        os.rename(temp_path, path)
+
+    def __remember(self, key, value):
+        if not self.memory_entries:
+            return
+
+        self.memory[key] = value
+
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def load(self, key):
+        """ Get the cached value for the given key, or None if no tier has
+        it. """
+
+        if key in self.memory:
+            # Move to the most recently used end
+            value = self.memory.pop(key)
+            self.memory[key] = value
+            self.hits['memory'] += 1
+            return value
+
+        for tier, directory in (('local', self.local_dir), ('shared', self.shared_dir)):
+            if not directory:
+                continue
+
+            try:
+                f = open(self.__path(directory, key), 'rb')
+            except IOError:
+                continue
+
+            data = f.read()
+            f.close()
+
+            if tier == 'shared' and self.local_dir:
+                self.__write(self.local_dir, key, data)
+
+            self.hits[tier] += 1
+            self.bytes_read += len(data)
+
+            value = pickle.loads(data)
+            self.__remember(key, value)
+            return value
+
+        self.misses += 1
+        return None
+
+    def store(self, key, value):
+        self.__remember(key, value)
+
+        if self.local_dir:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            self.bytes_written += len(data)
+            self.__write(self.local_dir, key, data)
+
+    def report(self):
+        report = 'Cache: %d local hits, %d shared hits, %d misses' % (
+            self.hits['local'], self.hits['shared'], self.misses)
+
+        if self.memory_entries:
+            report += ', %d memory hits' % (self.hits['memory'],)
+
+        return report
+
+class ASTCache(object):
+    """ In-memory LRU cache of parsed compilation units for long running
+    processes, keyed by a hash of the source.
+
+    The cache is bounded by a number of entries, an approximate size in bytes
+    (estimated from the length of the sources), or both. Parsing a changed
+    source for the same path drops the entry of its previous contents.
+
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.entries = collections.OrderedDict()
+        self.paths = {}
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __evict(self, key):
+        ast, size = self.entries.pop(key)
+        self.size -= size
+
+    def __is_full(self):
+        return ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes))
+
+    def parse(self, source, path=None):
+        """ Get the compilation unit of the given source, parsing it only if it
+        isn't cached. """
+
+        key = hashlib.sha1(source).hexdigest()
+
+        if path is not None:
+            previous = self.paths.get(path)
+            self.paths[path] = key
+
+            if previous is not None and previous != key and previous in self.entries:
+                self.__evict(previous)
+                self.evictions += 1
+
+        if key in self.entries:
+            # Move to the most recently used end
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        ast = javalang.parse.parse(source)
+        size = len(source) * AST_SIZE_FACTOR
+
+        self.entries[key] = (ast, size)
+        self.size += size
+
+        while self.entries and self.__is_full():
+            self.__evict(next(iter(self.entries)))
+            self.evictions += 1
+
+        return ast
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0}
@@ -1,18 +1,24 @@
 # Copyright (c) 2012 Bronto Software Inc.
 # Licensed under the MIT License
 
-import javalang
 import re
 
 import formatter
 import util
 import htmlrst
+import profiling
+
+javalang = util.LazyModule('javalang')
 
 class JavadocRestCompiler(object):
     """ Javadoc to ReST compiler. Builds ReST documentation from a Java syntax
     tree. """
 
-    def __init__(self, filter=None):
+    # Identifies the compiled output in the javasphinx-apidoc cache. Change it
+    # whenever the output changes so stale cache entries aren't used.
+    cache_tag = 'rst-4'
+
+    def __init__(self, filter=None, profiler=None, member_pages=0):
         if filter:
             self.filter = filter
         else:
@@ -20,9 +26,18 @@ class JavadocRestCompiler(object):
             self.filter = lambda node: isinstance(node, javalang.tree.Declaration) and 'private' not in node.modifiers
 
         self.converter = htmlrst.Converter()
+        self.profiler = profiler or profiling.NullProfiler()
+
+        # Types with more members than this have them documented on separate
+        # pages, see compile_type_document
+        self.member_pages = member_pages
+
+        if member_pages:
+            self.cache_tag = '%s-members-%d' % (self.cache_tag, member_pages)
 
     def __html_to_rst(self, s):
-        return self.converter.convert(s)
+        with self.profiler.fragment(s):
+            return self.converter.convert(s)
 
     def __output_doc(self, documented):
         if not isinstance(documented, javalang.tree.Documented):
@@ -163,8 +178,84 @@ class JavadocRestCompiler(object):
 
         return directive
 
-    def compile_type_document(self, imports_block, package, name, declaration):
-        """ Compile a complete document, documenting a type and its members """
+    def compile_member_summary(self, name, members):
+        """ Compile a table linking to the member documents of a type """
+
+        table = util.Directive('list-table')
+        filebasename = name.replace('.', '-')
+
+        for member_name, directive in members:
+            table.add_content('* - :doc:`%s <%s--%s>`\n  - ``%s``\n' % (
+                member_name, filebasename, member_name, directive.argument))
+
+        return table
+
+    def compile_member_document(self, imports_block, package, name, member_name, directives):
+        """ Compile a document for the members of a type with the given name """
+
+        document = util.Document()
+        document.add(imports_block)
+        document.add_heading(name + '.' + member_name, '=')
+
+        package_dir = util.Directive('java:package', package)
+        package_dir.add_option('noindex')
+        document.add_object(package_dir)
+
+        for directive in directives:
+            document.add_object(directive)
+
+        return document
+
+    def compile_enum_constants(self, name, declaration):
+        """ Compile the directives of the constants of an enum, as a list of
+        (constant name, directive) tuples. """
+
+        if not isinstance(declaration, javalang.tree.EnumDeclaration):
+            return []
+
+        enum_constants = list(declaration.body.constants)
+        enum_constants.sort(key=lambda c: c.name)
+
+        constants = []
+        for enum_constant in enum_constants:
+            c = self.compile_enum_constant(name, enum_constant)
+            c.add_option('outertype', name)
+            constants.append((enum_constant.name, c))
+
+        return constants
+
+    def compile_member_sections(self, name, declaration):
+        """ Compile the directives of the documented fields, constructors and
+        methods of a type. Returns a list of (title, members) sections, with
+        members a list of (member name, directive) tuples. """
+
+        fields = filter(self.filter, declaration.fields)
+        fields.sort(key=lambda f: f.declarators[0].name)
+
+        constructors = filter(self.filter, declaration.constructors)
+        constructors.sort(key=lambda c: c.name)
+
+        methods = filter(self.filter, declaration.methods)
+        methods.sort(key=lambda m: m.name)
+
+        sections = [('Fields', [(field.declarators[0].name, self.compile_field(field)) for field in fields]),
+                    ('Constructors', [(constructor.name, self.compile_constructor(constructor))
+                                      for constructor in constructors]),
+                    ('Methods', [(method.name, self.compile_method(method)) for method in methods])]
+
+        for title, members in sections:
+            for member_name, directive in members:
+                directive.add_option('outertype', name)
+
+        return sections
+
+    def compile_type_document(self, imports_block, package, name, declaration, member_documents=None):
+        """ Compile a complete document, documenting a type and its members.
+
+        If the type has more fields, constructors and methods than
+        member_pages and a dict is given for member_documents, the members are
+        documented in separate documents added to the dict by member name,
+        and the type document links to them instead. """
 
         outer_type = name.rpartition('.')[0]
 
@@ -185,56 +276,109 @@ class JavadocRestCompiler(object):
             type_dir.add_option('outertype', outer_type)
         document.add_object(type_dir)
 
-        if isinstance(declaration, javalang.tree.EnumDeclaration):
-            enum_constants = list(declaration.body.constants)
-            enum_constants.sort(key=lambda c: c.name)
-
+        enum_constants = self.compile_enum_constants(name, declaration)
+        if enum_constants:
             document.add_heading('Enum Constants')
-            for enum_constant in enum_constants:
-                document.add_heading(enum_constant.name, '^')
-                c = self.compile_enum_constant(name, enum_constant)
-                c.add_option('outertype', name)
-                document.add_object(c)
+            for constant_name, directive in enum_constants:
+                document.add_heading(constant_name, '^')
+                document.add_object(directive)
 
-        fields = filter(self.filter, declaration.fields)
-        if fields:
-            document.add_heading('Fields', '-')
-            fields.sort(key=lambda f: f.declarators[0].name)
-            for field in fields:
-                document.add_heading(field.declarators[0].name, '^')
-                f = self.compile_field(field)
-                f.add_option('outertype', name)
-                document.add_object(f)
+        sections = self.compile_member_sections(name, declaration)
 
-        constructors = filter(self.filter, declaration.constructors)
-        if constructors:
-            document.add_heading('Constructors', '-')
-            constructors.sort(key=lambda c: c.name)
-            for constructor in constructors:
-                document.add_heading(constructor.name, '^')
-                c = self.compile_constructor(constructor)
-                c.add_option('outertype', name)
-                document.add_object(c)
+        split = (self.member_pages and member_documents is not None and
+                 sum(len(members) for title, members in sections) > self.member_pages)
+        member_directives = {}
 
-        methods = filter(self.filter, declaration.methods)
-        if methods:
-            document.add_heading('Methods', '-')
-            methods.sort(key=lambda m: m.name)
-            for method in methods:
-                document.add_heading(method.name, '^')
-                m = self.compile_method(method)
-                m.add_option('outertype', name)
-                document.add_object(m)
+        for title, members in sections:
+            if not members:
+                continue
+
+            document.add_heading(title, '-')
+
+            if split:
+                document.add_object(self.compile_member_summary(name, members))
+
+                for member_name, directive in members:
+                    member_directives.setdefault(member_name, list()).append(directive)
+            else:
+                for member_name, directive in members:
+                    document.add_heading(member_name, '^')
+                    document.add_object(directive)
+
+        if member_directives:
+            toc = util.Directive('toctree')
+            toc.add_option('hidden')
+            document.add_object(toc)
+
+            for member_name in sorted(member_directives):
+                toc.add_content('%s--%s\n' % (name.replace('.', '-'), member_name))
+                member_documents[member_name] = self.compile_member_document(
+                    imports_block, package, name, member_name, member_directives[member_name])
 
         return document
 
-    def compile(self, ast):
-        """ Compile autodocs for the given Java syntax tree. Documents will be
-        returned documenting each separate type. """
+    def compile_type_body(self, imports_block, package, name, declaration):
+        """ Compile the documentation of a type and its members without any
+        headings, for inclusion within another document. The members are
+        nested within the type directive. """
 
-        documents = {}
+        document = util.Document()
+        document.add(imports_block)
 
-        imports = util.StringBuilder()
+        package_dir = util.Directive('java:package', package)
+        package_dir.add_option('noindex')
+        document.add_object(package_dir)
+
+        type_dir = self.compile_type(declaration)
+        outer_type = name.rpartition('.')[0]
+        if outer_type:
+            type_dir.add_option('outertype', outer_type)
+        document.add_object(type_dir)
+
+        for constant_name, directive in self.compile_enum_constants(name, declaration):
+            type_dir.add_content(directive)
+
+        for title, members in self.compile_member_sections(name, declaration):
+            for member_name, directive in members:
+                type_dir.add_content(directive)
+
+        return document
+
+    def find_type_declarations(self, ast):
+        """ Find all documented type declarations within the given Java syntax
+        tree. Returns a list of (package, name, declaration) tuples.
+
+        Only top level and member types are visited, so the bodies of methods,
+        constructors and initializers are never walked. Local and anonymous
+        classes are not part of the API and are not documented. """
+
+        package = ast.package.name
+        type_declarations = []
+
+        def visit(outer, declaration):
+            classes = outer + [declaration.name]
+
+            if self.filter(declaration):
+                type_declarations.append((package, '.'.join(classes), declaration))
+
+            body = declaration.body
+            if isinstance(body, javalang.tree.EnumBody):
+                body = body.declarations
+
+            for member in body or ():
+                if isinstance(member, javalang.tree.TypeDeclaration):
+                    visit(classes, member)
+
+        for declaration in ast.types:
+            visit([], declaration)
+
+        return type_declarations
+
+    def compile_imports(self, ast):
+        """ Compile the java:imports directive declaring the imports of the
+        given Java syntax tree. """
+
+        imports = util.Directive('java:imports')
         for imp in ast.imports:
             if imp.static or imp.wildcard:
                 continue
@@ -248,27 +392,114 @@ class JavadocRestCompiler(object):
                 else:
                     package_parts.append(part)
 
+            # Imports not following the naming conventions can't be split into
+            # a package and a type
+            if not package_parts or not cls_parts:
+                continue
+
             package = '.'.join(package_parts)
             cls = '.'.join(cls_parts)
 
-            imports.append(util.Directive('java:import', package + ' ' + cls).build())
-        import_block = imports.build()
+            imports.add_content('%s %s\n' % (package, cls))
 
-        package = ast.package.name
-        type_declarations = []
-        for path, node in ast.filter(javalang.tree.TypeDeclaration):
-            if not self.filter(node):
-                continue
+        # A single directive declares all imports of the page
+        if imports.content:
+            return imports.build()
+        else:
+            return ''
 
-            classes = [n.name for n in path if isinstance(n, javalang.tree.TypeDeclaration)]
-            classes.append(node.name)
+    def compile(self, ast):
+        """ Compile autodocs for the given Java syntax tree. Documents will be
+        returned documenting each separate type. """
 
-            name = '.'.join(classes)
-            type_declarations.append((package, name, node))
+        documents = {}
+        import_block = self.compile_imports(ast)
 
-        for package, name, declaration in type_declarations:
+        for package, name, declaration in self.find_type_declarations(ast):
             full_name = package + '.' + name
-            document = self.compile_type_document(import_block, package, name, declaration)
-            documents[full_name] = (package, name, document.build())
+            member_documents = {}
+            document = self.compile_type_document(import_block, package, name, declaration, member_documents)
+
+            with self.profiler.stage('build'):
+                documents[full_name] = (package, name, document.build())
+
+                # Member documents are named Type#member
+                for member_name, member_document in member_documents.items():
+                    documents[full_name + '#' + member_name] = (package, name + '#' + member_name,
+                                                                member_document.build())
+
+        return documents
+
+class JavadocModelCompiler(JavadocRestCompiler):
+    """ Builds a structured model of the documented types and their members
+    from a Java syntax tree, with Javadoc converted to ReST. """
+
+    cache_tag = 'model-2'
+
+    def __model(self, kind, name, directive):
+        doc = u''.join(d.build() for d in directive.content)
+
+        return {
+            'kind': kind,
+            'name': name,
+            'signature': directive.argument,
+            'doc': doc.strip()
+            }
+
+    def compile_type_model(self, package, name, declaration):
+        """ Compile the model of a type and its members """
+
+        if isinstance(declaration, javalang.tree.ClassDeclaration):
+            kind = 'class'
+        elif isinstance(declaration, javalang.tree.InterfaceDeclaration):
+            kind = 'interface'
+        elif isinstance(declaration, javalang.tree.EnumDeclaration):
+            kind = 'enum'
+        else:
+            kind = 'annotation'
+
+        model = self.__model(kind, name, self.compile_type(declaration))
+        model['package'] = package
+        members = model['members'] = []
+
+        for member_name, directive in self.compile_enum_constants(name, declaration):
+            members.append(self.__model('enum_constant', member_name, directive))
+
+        kinds = {'Fields': 'field', 'Constructors': 'constructor', 'Methods': 'method'}
+
+        for title, section in self.compile_member_sections(name, declaration):
+            for member_name, directive in section:
+                members.append(self.__model(kinds[title], member_name, directive))
+
+        return model
+
+    def compile(self, ast):
+        """ Compile models for the given Java syntax tree. Models are returned
+        in place of documents for each separate type. """
+
+        documents = {}
+
+        for package, name, declaration in self.find_type_declarations(ast):
+            full_name = package + '.' + name
+            documents[full_name] = (package, name, self.compile_type_model(package, name, declaration))
+
+        return documents
+
+class JavadocBodyCompiler(JavadocRestCompiler):
+    """ Compiles the documentation of each type and its members without any
+    headings, for the java:autotype directive. """
+
+    cache_tag = 'body-2'
+
+    def compile(self, ast):
+        documents = {}
+        import_block = self.compile_imports(ast)
+
+        for package, name, declaration in self.find_type_declarations(ast):
+            full_name = package + '.' + name
+            document = self.compile_type_body(import_block, package, name, declaration)
+
+            with self.profiler.stage('build'):
+                documents[full_name] = (package, name, document.build())
 
         return documents
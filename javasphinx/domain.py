@@ -15,12 +15,19 @@ from sphinx.directives import ObjectDescription
 from sphinx.util.nodes import make_refnode
 from sphinx.util.docfields import Field, TypedField, GroupedField
 
-import javalang
-
+import autodoc
 import extdoc
 import formatter
+import inventory
 import util
 
+javalang = util.LazyModule('javalang')
+
+# Object types, in the order defining the integer codes stored in the domain
+# data
+OBJECT_TYPES = ('package', 'type', 'field', 'constructor', 'method')
+OBJECT_TYPE_CODES = dict((objtype, code) for code, objtype in enumerate(OBJECT_TYPES))
+
 class JavaObject(ObjectDescription):
     option_spec = {
         'noindex': directives.flag,
@@ -121,7 +128,6 @@ class JavaObject(ObjectDescription):
         type = self.get_type();
 
         fullname = '.'.join(filter(None, (package, type, name)))
-        basename = fullname.partition('(')[0]
 
         # note target
         if fullname not in self.state.document.ids:
@@ -138,7 +144,7 @@ class JavaObject(ObjectDescription):
                     ', use :noindex: for one of them',
                     line=self.lineno)
 
-            objects[fullname] = (self.env.docname, self.objtype, basename)
+            self.env.get_domain('java').note_object(fullname, self.objtype, self.env.docname)
 
         indextext = self.get_index_text(package, type, name)
         if indextext:
@@ -368,7 +374,7 @@ class JavaPackage(Directive):
         package = self.arguments[0].strip()
         noindex = 'noindex' in self.options
         env.temp_data['java:package'] = package
-        env.domaindata['java']['objects'][package] = (env.docname, 'package', package)
+        env.get_domain('java').note_object(package, 'package', env.docname)
         ret = []
 
         if not noindex:
@@ -403,6 +409,38 @@ class JavaImport(Directive):
         env.temp_data.setdefault('java:imports', dict())[typename] = package
         return []
 
+class JavaImports(Directive):
+    """
+    Declare many imports at once, one "package type" pair per line of content.
+    """
+
+    has_content = True
+    required_arguments = 0
+    optional_arguments = 0
+    final_argument_whitespace = False
+    option_spec = {}
+
+    def run(self):
+        env = self.state.document.settings.env
+        imports = env.temp_data.setdefault('java:imports', dict())
+
+        for line in self.content:
+            parts = line.split()
+
+            if not parts:
+                continue
+
+            if len(parts) != 2:
+                self.state_machine.reporter.warning(
+                    'invalid import "%s", expected a package and a type' % (line.strip(),),
+                    line=self.lineno)
+                continue
+
+            package, typename = parts
+            imports[typename] = package
+
+        return []
+
 class JavaXRefRole(XRefRole):
     def process_link(self, env, refnode, has_explicit_title, title, target):
         refnode['java:outertype'] = '.'.join(env.temp_data.get('java:outertype', list()))
@@ -456,7 +494,9 @@ class JavaDomain(Domain):
         'field':          JavaField,
         'constructor':    JavaConstructor,
         'method':         JavaMethod,
-        'import':         JavaImport
+        'import':         JavaImport,
+        'imports':        JavaImports,
+        'autotype':       autodoc.JavaAutoType
     }
 
     roles = {
@@ -469,11 +509,35 @@ class JavaDomain(Domain):
     }
 
     initial_data = {
-        'objects': {},  # fullname -> docname, objtype, basename
+        'objects': {},  # fullname -> docname, objtype code
     }
 
+    data_version = 1
+
+    def note_object(self, fullname, objtype, docname):
+        self.data['objects'][fullname] = (docname, OBJECT_TYPE_CODES[objtype])
+
+    def get_object(self, fullname):
+        """ Get the (docname, objtype, basename) tuple for the given object, or
+        None if it isn't known. """
+
+        entry = self.data['objects'].get(fullname)
+
+        if entry:
+            docname, code = entry
+            return docname, OBJECT_TYPES[code], fullname.partition('(')[0]
+        else:
+            return None
+
+    def iter_objects(self):
+        """ Iterate over (fullname, docname, objtype, basename) tuples for all
+        known objects. """
+
+        for fullname, (docname, code) in self.data['objects'].iteritems():
+            yield fullname, docname, OBJECT_TYPES[code], fullname.partition('(')[0]
+
     def clear_doc(self, docname):
-        for fullname, (fn, _, _) in self.data['objects'].items():
+        for fullname, (fn, _) in self.data['objects'].items():
             if fn == docname:
                 del self.data['objects'][fullname]
 
@@ -507,15 +571,28 @@ class JavaDomain(Domain):
         basename_match = None
         basename_suffix = suffix.partition('(')[0]
 
-        for fullname, (_, _, basename) in objects.items():
+        for fullname in objects:
             if fullname.endswith(suffix):
                 return make_ref(fullname)
-            elif basename.endswith(basename_suffix):
+            elif fullname.partition('(')[0].endswith(basename_suffix):
                 basename_match = fullname
 
         if basename_match:
             return make_ref(basename_match)
 
+        # Try the inventories exported by other projects
+        candidates = [target]
+        if package:
+            candidates.append(package + '.' + target)
+            if type_context:
+                candidates.append(package + '.' + type_context + '.' + target)
+
+        ref = inventory.get_inventory_ref(env, candidates)
+
+        if ref:
+            ref.append(contnode)
+            return ref
+
         # Try creating an external documentation reference
         ref = extdoc.get_javadoc_ref(self.env, target, target)
 
@@ -531,5 +608,25 @@ class JavaDomain(Domain):
             return None
 
     def get_objects(self):
-        for refname, (docname, type, _) in self.data['objects'].iteritems():
-            yield (refname, refname, type, docname, refname, 1)
+        priorities = self.env.config.javasphinx_search_priorities
+        overloads = self.env.config.javasphinx_search_overloads
+
+        # Overloaded methods and constructors are optionally collapsed to a
+        # single search entry for their name, the one of the first overload
+        first_overloads = {}
+
+        if not overloads:
+            for refname, docname, type, basename in self.iter_objects():
+                if type in ('method', 'constructor'):
+                    if basename not in first_overloads or refname < first_overloads[basename]:
+                        first_overloads[basename] = refname
+
+        for refname, docname, type, basename in self.iter_objects():
+            priority = priorities.get(type, 1)
+
+            # Keep the other signatures out of the search index, but still
+            # list them in the object inventory
+            if type in ('method', 'constructor') and first_overloads.get(basename, refname) != refname:
+                priority = -1
+
+            yield (refname, refname, type, docname, refname, priority)
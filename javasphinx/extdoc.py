@@ -1,20 +1,125 @@
 # Copyright (c) 2012 Bronto Software Inc.
 # Licensed under the MIT License
 
+import os
+
 from docutils import nodes, utils
+from sphinx.util import logging
 from sphinx.util.nodes import split_explicit_title
 
-def get_javadoc_ref(app, rawtext, text):
-    javadoc_url_map = app.config.javadoc_url_map
+logger = logging.getLogger(__name__)
+
+def split_name(text):
+    """ Split a qualified name into its package and class parts, e.g.
+    'java.util.Map.Entry' -> ('java.util', 'Map.Entry'). """
+
+    package_parts = []
+    cls_parts = []
+
+    for part in text.split('.'):
+        if cls_parts or part[0].isupper():
+            cls_parts.append(part)
+        else:
+            package_parts.append(part)
+
+    return '.'.join(package_parts), '.'.join(cls_parts)
+
+def parse_inventory(filename):
+    """ Read a local package inventory. Javadoc package-list and element-list
+    files list one package per line, a javasphinx class inventory lists one
+    fully qualified type name per line. Both may be mixed in a single file.
+
+    Returns a tuple of sets (packages, types).
+
+    """
+
+    packages = set()
+    types = set()
+
+    f = open(filename)
+
+    for line in f:
+        line = line.strip()
+
+        # element-list files also name the module each package belongs to
+        if not line or line.startswith('#') or line.startswith('module:'):
+            continue
+
+        package, cls = split_name(line)
+
+        if cls:
+            types.add(line)
+
+        packages.add(package)
+
+    f.close()
+
+    return packages, types
+
+def refresh_inventories(app):
+    """ Drop cached inventories whose files changed since they were loaded. """
+
+    env = app.env
+    inventories = getattr(env, 'javadoc_inventories', None)
 
-    # Add default sources
-    javadoc_url_map["java"] = ("http://docs.oracle.com/javase/6/docs/api", 'javadoc')
-    javadoc_url_map["javax"] = ("http://docs.oracle.com/javase/6/docs/api", 'javadoc')
-    javadoc_url_map["org.xml"] = ("http://docs.oracle.com/javase/6/docs/api", 'javadoc')
-    javadoc_url_map["org.w3c"] = ("http://docs.oracle.com/javase/6/docs/api", 'javadoc')
+    if not inventories:
+        return
+
+    for path, (mtime, _, _) in inventories.items():
+        if not os.path.exists(path) or os.stat(path).st_mtime != mtime:
+            del inventories[path]
+
+def get_inventory(env, filename):
+    """ Get the (packages, types) sets for the given inventory file, or None if
+    it can't be read. Files are only read once and then cached in the
+    environment. """
+
+    path = os.path.join(env.srcdir, filename)
+
+    if not hasattr(env, 'javadoc_inventories'):
+        env.javadoc_inventories = {}
+
+    inventory = env.javadoc_inventories.get(path)
+
+    if not inventory:
+        try:
+            mtime = os.stat(path).st_mtime
+            packages, types = parse_inventory(path)
+        except (IOError, OSError) as e:
+            # Warn only once, references are then linked unchecked
+            logger.warning('cannot read Javadoc inventory %s: %s' % (path, e))
+            mtime, packages, types = None, None, None
+
+        inventory = (mtime, packages, types)
+        env.javadoc_inventories[path] = inventory
+
+    if inventory[1] is None:
+        return None
+
+    return inventory[1], inventory[2]
+
+def find_source(javadoc_url_map, text):
+    """ Find the longest package in the URL map which is a prefix of text """
+
+    prefix = text
+
+    while '.' in prefix:
+        prefix = prefix.rpartition('.')[0]
+
+        if prefix in javadoc_url_map:
+            return javadoc_url_map[prefix]
+
+    return None
+
+def get_javadoc_ref(env, rawtext, text):
+    javadoc_url_map = env.config.javadoc_url_map
+
+    # Add default sources, unless configured explicitly
+    javadoc_url_map.setdefault("java", ("http://docs.oracle.com/javase/6/docs/api", 'javadoc'))
+    javadoc_url_map.setdefault("javax", ("http://docs.oracle.com/javase/6/docs/api", 'javadoc'))
+    javadoc_url_map.setdefault("org.xml", ("http://docs.oracle.com/javase/6/docs/api", 'javadoc'))
+    javadoc_url_map.setdefault("org.w3c", ("http://docs.oracle.com/javase/6/docs/api", 'javadoc'))
 
-    source = None
-    package = ''
     method = None
 
     if '(' in text:
@@ -22,26 +127,29 @@ def get_javadoc_ref(app, rawtext, text):
         method = text[split_point + 1:]
         text = text[:split_point]
 
-    for pkg, (baseurl, ext_type) in javadoc_url_map.items():
-        if text.startswith(pkg + '.') and len(pkg) > len(package):
-            source = baseurl, ext_type
+    source = find_source(javadoc_url_map, text)
 
     if not source:
         return None
 
-    baseurl, ext_type = source
+    baseurl, ext_type = source[:2]
+    package, cls = split_name(text)
 
-    package_parts = []
-    cls_parts = []
+    # Only link to targets the library is known to contain if an inventory
+    # was given for it
+    inventory = None
+    if len(source) > 2 and source[2]:
+        inventory = get_inventory(env, source[2])
 
-    for part in text.split('.'):
-        if cls_parts or part[0].isupper():
-            cls_parts.append(part)
-        else:
-            package_parts.append(part)
+    if inventory:
+        packages, types = inventory
+
+        if package not in packages:
+            return None
 
-    package = '.'.join(package_parts)
-    cls = '.'.join(cls_parts)
+        outer_cls = cls.partition('.')[0]
+        if types and package + '.' + cls not in types and package + '.' + outer_cls not in types:
+            return None
 
     if not baseurl.endswith('/'):
         baseurl = baseurl + '/'
@@ -77,11 +185,13 @@ def javadoc_role(name, rawtext, text, lineno, inliner, options={}, content=[]):
         if title[0] == '~':
             title = title[1:].rpartition('.')[2]
 
-    app = inliner.document.settings.env.app
-    ref = get_javadoc_ref(app, rawtext, target)
+    env = inliner.document.settings.env
+    ref = get_javadoc_ref(env, rawtext, target)
 
     if not ref:
-         raise ValueError("no Javadoc source found for %s in javadoc_url_map" % (target,))
+        inliner.reporter.warning('no Javadoc source found for %s in javadoc_url_map' % (target,),
+                                 line=lineno)
+        return [nodes.literal(rawtext, title)], []
 
     ref.append(nodes.Text(title, title))
 
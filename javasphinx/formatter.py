@@ -6,9 +6,9 @@ Convert Java syntax tree nodes to string representations.
 
 """
 
-import javalang
+from util import LazyModule, StringBuilder
 
-from util import StringBuilder
+javalang = LazyModule('javalang')
 
 # The order for displaying modifiers
 __modifiers_order = ('public', 'protected', 'private', 'static', 'abstract', 'final',
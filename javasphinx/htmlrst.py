@@ -5,7 +5,6 @@ import collections
 import re
 
 from xml.sax.saxutils import escape as html_escape
-from bs4 import BeautifulSoup
 
 Cell = collections.namedtuple('Cell', ['type', 'rowspan', 'colspan', 'contents'])
 
@@ -386,6 +385,10 @@ class Converter(object):
         if not s_html.strip():
             return ''
 
+        # Importing bs4 pulls in lxml, so it's deferred until the first
+        # conversion
+        from bs4 import BeautifulSoup
+
         soup = BeautifulSoup(s_html, 'lxml')
         top = soup.html.body
 
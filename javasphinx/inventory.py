@@ -0,0 +1,177 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Compact inventories of the objects documented by the Java domain, allowing
+separate Sphinx projects to cross reference each other's Java APIs.
+
+An inventory starts with a short plain text header, followed by zlib compressed
+lines of the form 'fullname<TAB>objtype<TAB>docuri', sorted by fullname.
+
+"""
+
+import os
+import zlib
+
+from docutils import nodes
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_FILENAME = 'javasphinx.inv'
+INVENTORY_HEADER = '# javasphinx inventory version 1\n'
+
+# Combined inventory indexes by source directory, as (inventories, mtimes,
+# index) tuples. They are kept out of the environment so it isn't pickled with
+# them.
+_inventory_indexes = {}
+
+def get_anchor(fullname, objtype):
+    if objtype == 'package':
+        return 'package-' + fullname
+    else:
+        return fullname
+
+def write_inventory(filename, project, objects):
+    """ Write an inventory file for the given iterable of (fullname, objtype,
+    docuri) tuples. """
+
+    f = open(filename, 'wb')
+    f.write(INVENTORY_HEADER)
+    f.write(('# Project: %s\n' % (project,)).encode('utf8'))
+    f.write('# The remainder of this file is compressed using zlib.\n')
+
+    compressor = zlib.compressobj(9)
+
+    for fullname, objtype, docuri in sorted(objects):
+        line = u'%s\t%s\t%s\n' % (fullname, objtype, docuri)
+        f.write(compressor.compress(line.encode('utf8')))
+
+    f.write(compressor.flush())
+    f.close()
+
+def read_inventory(filename, baseurl):
+    """ Read an inventory file. Returns a dictionary mapping each full name to
+    an (objtype, uri) tuple, with URIs made absolute using baseurl. """
+
+    f = open(filename, 'rb')
+
+    if f.readline() != INVENTORY_HEADER:
+        f.close()
+        raise ValueError('%s is not a javasphinx inventory' % (filename,))
+
+    # Skip the project and compression lines
+    f.readline()
+    f.readline()
+
+    data = zlib.decompress(f.read()).decode('utf8')
+    f.close()
+
+    if not baseurl.endswith('/'):
+        baseurl = baseurl + '/'
+
+    index = {}
+
+    for line in data.splitlines():
+        fullname, objtype, docuri = line.split('\t')
+        uri = baseurl + docuri + '#' + get_anchor(fullname, objtype)
+        index[fullname] = (objtype, uri)
+
+    return index
+
+def export_inventory(app, exception):
+    """ Write the Java domain objects to the output directory at the end of
+    an HTML build, if enabled by javasphinx_export_inventory. """
+
+    builder = app.builder
+
+    if exception or not app.config.javasphinx_export_inventory or builder.format != 'html':
+        return
+
+    objects = []
+
+    for fullname, docname, objtype, _ in app.env.get_domain('java').iter_objects():
+        objects.append((fullname, objtype, builder.get_target_uri(docname)))
+
+    write_inventory(os.path.join(builder.outdir, INVENTORY_FILENAME), app.config.project, objects)
+
+def refresh_inventory_index(app):
+    """ Drop the cached index if any of the configured inventories changed. """
+
+    env = app.env
+
+    # Environments pickled by earlier versions held the index
+    if hasattr(env, 'javasphinx_inventory_index'):
+        del env.javasphinx_inventory_index
+
+    cached = _inventory_indexes.get(env.srcdir)
+
+    if cached is None:
+        return
+
+    inventories, mtimes, _ = cached
+
+    if inventories != env.config.javasphinx_inventories or mtimes != get_inventory_mtimes(env):
+        del _inventory_indexes[env.srcdir]
+
+def get_inventory_mtimes(env):
+    mtimes = {}
+
+    for name, (baseurl, filename) in env.config.javasphinx_inventories.items():
+        path = os.path.join(env.srcdir, filename)
+
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            # Reported once the index is loaded
+            mtimes[path] = None
+
+    return mtimes
+
+def get_inventory_index(env):
+    """ Get the combined index of all inventories configured in
+    javasphinx_inventories. Inventories are only loaded when first needed, and
+    the index is cached for as long as the process runs. """
+
+    cached = _inventory_indexes.get(env.srcdir)
+
+    if cached is not None:
+        return cached[2]
+
+    mtimes = get_inventory_mtimes(env)
+    index = {}
+
+    # Sort by name so that where inventories overlap the alphabetically first
+    # one consistently wins
+    for name, (baseurl, filename) in sorted(env.config.javasphinx_inventories.items(), reverse=True):
+        path = os.path.join(env.srcdir, filename)
+
+        try:
+            index.update(read_inventory(path, baseurl))
+        except (IOError, OSError, ValueError, zlib.error) as e:
+            logger.warning('cannot read Java inventory %s: %s' % (path, e))
+
+    _inventory_indexes[env.srcdir] = (dict(env.config.javasphinx_inventories), mtimes, index)
+
+    return index
+
+def get_inventory_ref(env, candidates):
+    """ Create a reference to the first candidate full name found in the
+    configured inventories, or None if none is found. """
+
+    if not env.config.javasphinx_inventories:
+        return None
+
+    index = get_inventory_index(env)
+
+    for fullname in candidates:
+        if fullname in index:
+            objtype, uri = index[fullname]
+
+            node = nodes.reference('', '', internal=False)
+            node['refuri'] = uri
+            node['reftitle'] = fullname
+
+            return node
+
+    return None
@@ -0,0 +1,291 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Timing and memory use of the stages of javasphinx-apidoc runs.
+
+"""
+
+import contextlib
+import heapq
+import json
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Only Python 3.4+ and Python 2 patched for the pytracemalloc backport have
+    # it, otherwise memory is traced using the peak resident set size
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# CPU time of the current process
+if hasattr(time, 'process_time'):
+    cpu_time = time.process_time
+else:
+    cpu_time = time.clock
+
+class NullProfiler(object):
+    """ Profiler interface which records nothing """
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        yield
+
+    @contextlib.contextmanager
+    def source(self, source_file):
+        yield
+
+    @contextlib.contextmanager
+    def fragment(self, fragment):
+        yield
+
+class Profiler(NullProfiler):
+    """ Accumulates the wall and CPU time spent in each stage, and keeps track of
+    the slowest source files and Javadoc fragments. Stages may be nested, in
+    which case the time of the inner stage is also included in the outer
+    one. """
+
+    # Maximum length of fragments included in the report
+    fragment_length = 200
+
+    def __init__(self, num_slowest=20):
+        self.num_slowest = num_slowest
+
+        self.stages = {}
+        self.stage_order = []
+        self.slowest_sources = []
+        self.slowest_fragments = []
+        self.current_source = None
+
+        self.start_wall = time.time()
+        self.start_cpu = cpu_time()
+
+    def __keep_slowest(self, heap, entry):
+        if len(heap) < self.num_slowest:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall = time.time()
+        cpu = cpu_time()
+
+        try:
+            yield
+        finally:
+            stats = self.stages.get(name)
+
+            if stats is None:
+                stats = self.stages[name] = [0, 0.0, 0.0]
+                self.stage_order.append(name)
+
+            stats[0] += 1
+            stats[1] += time.time() - wall
+            stats[2] += cpu_time() - cpu
+
+    @contextlib.contextmanager
+    def source(self, source_file):
+        self.current_source = source_file
+        wall = time.time()
+
+        try:
+            yield
+        finally:
+            self.__keep_slowest(self.slowest_sources, (time.time() - wall, source_file))
+            self.current_source = None
+
+    @contextlib.contextmanager
+    def fragment(self, fragment):
+        wall = time.time()
+
+        try:
+            with self.stage('htmlrst'):
+                yield
+        finally:
+            entry = (time.time() - wall, self.current_source, fragment[:self.fragment_length])
+            self.__keep_slowest(self.slowest_fragments, entry)
+
+    def report(self, source_cache=None):
+        """ Build the report as a JSON serializable dictionary """
+
+        report = {
+            'total': {
+                'wall': time.time() - self.start_wall,
+                'cpu': cpu_time() - self.start_cpu
+                },
+            'stages': [{'name': name, 'calls': calls, 'wall': wall, 'cpu': cpu}
+                       for name, (calls, wall, cpu) in
+                       ((name, self.stages[name]) for name in self.stage_order)],
+            'slowest_sources': [{'source': source_file, 'wall': wall}
+                                for wall, source_file in sorted(self.slowest_sources, reverse=True)],
+            'slowest_fragments': [{'source': source_file, 'wall': wall, 'fragment': fragment}
+                                  for wall, source_file, fragment in sorted(self.slowest_fragments, reverse=True)],
+            'cache': None
+            }
+
+        if source_cache:
+            report['cache'] = {
+                'local_hits': source_cache.hits['local'],
+                'shared_hits': source_cache.hits['shared'],
+                'misses': source_cache.misses
+                }
+
+        return report
+
+    def write_report(self, filename, source_cache=None):
+        f = open(filename, 'w')
+        json.dump(self.report(source_cache), f, indent=2, sort_keys=True)
+        f.write('\n')
+        f.close()
+
+# ------------------------------------------------------------------------------
+# ---- Memory tracing ----
+
+def get_deep_size(obj, seen=None):
+    """ Get the size in bytes of the given object along with the containers,
+    strings and tuples it references. Shared objects are counted once. """
+
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += get_deep_size(key, seen) + get_deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += get_deep_size(item, seen)
+
+    return size
+
+def get_peak_rss():
+    """ Get the peak resident set size of the current process in bytes """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform != 'darwin':
+        peak *= 1024
+
+    return peak
+
+class NullMemoryTracer(object):
+    """ Memory tracer interface which records nothing """
+
+    def snapshot(self, stage):
+        pass
+
+    def measure(self, name, obj):
+        pass
+
+class MemoryTracer(NullMemoryTracer):
+    """ Takes a tracemalloc snapshot at the end of each stage, recording the
+    current and peak traced memory and the allocation sites which grew the
+    most during the stage.
+
+    Without tracemalloc only the peak resident set size of the process is
+    recorded for each stage, with no current size or allocation sites.
+
+    """
+
+    def __init__(self, num_sites=20):
+        if tracemalloc is None and resource is None:
+            raise RuntimeError('memory tracing requires the tracemalloc or resource module')
+
+        self.num_sites = num_sites
+        self.stages = []
+        self.sizes = []
+        self.last_snapshot = None
+
+        if tracemalloc is not None:
+            tracemalloc.start()
+
+    def __get_sites(self, stats):
+        sites = []
+
+        for stat in stats[:self.num_sites]:
+            frame = stat.traceback[0]
+            sites.append({'file': frame.filename,
+                          'line': frame.lineno,
+                          'size': stat.size,
+                          'count': stat.count,
+                          'size_diff': getattr(stat, 'size_diff', stat.size)})
+
+        return sites
+
+    def snapshot(self, stage):
+        if tracemalloc is None:
+            self.stages.append({'name': stage,
+                                'current': None,
+                                'peak': get_peak_rss(),
+                                'top_sites': []})
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+
+        if self.last_snapshot is None:
+            stats = snapshot.statistics('lineno')
+        else:
+            stats = snapshot.compare_to(self.last_snapshot, 'lineno')
+
+        self.stages.append({'name': stage,
+                            'current': current,
+                            'peak': peak,
+                            'top_sites': self.__get_sites(stats)})
+        self.last_snapshot = snapshot
+
+    def measure(self, name, obj):
+        """ Record the deep size of an object retained by the run """
+
+        self.sizes.append({'name': name, 'size': get_deep_size(obj)})
+
+    def report(self, source_cache=None):
+        """ Build the report as a JSON serializable dictionary """
+
+        if tracemalloc is None:
+            current, peak = None, get_peak_rss()
+        else:
+            current, peak = tracemalloc.get_traced_memory()
+
+        report = {
+            'method': 'rusage' if tracemalloc is None else 'tracemalloc',
+            'current': current,
+            'peak': peak,
+            'stages': self.stages,
+            'top_sites': [],
+            'retained': self.sizes,
+            'cache': None
+            }
+
+        if self.last_snapshot is not None:
+            report['top_sites'] = self.__get_sites(self.last_snapshot.statistics('lineno'))
+
+        if source_cache:
+            report['cache'] = {
+                'bytes_read': source_cache.bytes_read,
+                'bytes_written': source_cache.bytes_written
+                }
+
+        return report
+
+    def write_report(self, filename, source_cache=None):
+        f = open(filename, 'w')
+        json.dump(self.report(source_cache), f, indent=2, sort_keys=True)
+        f.write('\n')
+        f.close()
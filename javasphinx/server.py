@@ -0,0 +1,317 @@
+# Copyright (c) 2012 Bronto Software Inc.
+# Licensed under the MIT License
+
+"""
+Long running javasphinx-apidoc server, answering JSON-RPC 2.0 requests over a
+Unix socket or stdin/stdout, and a client for it.
+
+Requests and responses are JSON objects, one per line. The server keeps
+parsed sources and converted Javadoc fragments in memory between requests.
+Supported methods are,
+
+  regenerate  params: {"files": [...], "output_dir": ..., "suffix": "rst",
+                       "notoc": false}
+              Compile the given source files, write their documents and
+              update the indexes of their packages.
+  render      params: {"fragment": ...}
+              Convert a Javadoc HTML fragment to reST.
+  stats       Cache statistics.
+  shutdown    Stop the server.
+
+"""
+
+import collections
+import json
+import os
+import socket
+import SocketServer
+import sys
+
+from optparse import OptionParser, Values
+
+import apidoc
+import cache
+import compiler
+import htmlrst
+
+DEFAULT_SOCKET = '.javasphinx-apidoc.sock'
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+class MemoizingConverter(object):
+    """ htmlrst.Converter remembering the output for up to max_entries of the
+    most recently converted fragments. """
+
+    def __init__(self, max_entries=10000):
+        self.converter = htmlrst.Converter()
+        self.max_entries = max_entries
+        self.memo = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def convert(self, s_html):
+        if s_html in self.memo:
+            result = self.memo.pop(s_html)
+            self.memo[s_html] = result
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = self.memo[s_html] = self.converter.convert(s_html)
+
+        if len(self.memo) > self.max_entries:
+            self.memo.popitem(last=False)
+
+        return result
+
+class ApidocService(object):
+    """ Implementation of the server's methods, holding the state shared
+    between requests. """
+
+    def __init__(self, source_cache, ast_cache=None):
+        self.source_cache = source_cache
+        self.ast_cache = ast_cache
+        self.converter = MemoizingConverter()
+        self.doc_compiler = compiler.JavadocRestCompiler()
+        self.doc_compiler.converter = self.converter
+        self.running = True
+
+    def regenerate(self, files, output_dir, suffix='rst', notoc=False):
+        if not isinstance(files, list) or not files:
+            raise RpcError(INVALID_PARAMS, 'files must be a non-empty list')
+
+        for source_file in files:
+            if not os.path.isfile(source_file):
+                raise RpcError(INVALID_PARAMS, '%s is not a file' % (source_file,))
+
+        opts = Values({'destdir': output_dir, 'suffix': suffix.lstrip('.'), 'force': True,
+                       'update': False, 'notoc': notoc})
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        try:
+            packages, documents, sources = apidoc.generate_documents(files, self.source_cache, False,
+                                                                     self.doc_compiler, None, self.ast_cache)
+            package_contents = apidoc.write_documents(documents, sources, opts)
+
+            if package_contents:
+                apidoc.update_package_indexes(package_contents, opts)
+        finally:
+            apidoc.close_archives()
+
+        return {'documents': sorted(documents), 'packages': sorted(packages)}
+
+    def render(self, fragment):
+        return {'rst': self.converter.convert(fragment)}
+
+    def stats(self):
+        return {'cache': {'hits': self.source_cache.hits, 'misses': self.source_cache.misses},
+                'ast_cache': self.ast_cache.stats() if self.ast_cache else None,
+                'fragments': {'hits': self.converter.hits, 'misses': self.converter.misses}}
+
+    def shutdown(self):
+        self.running = False
+        return None
+
+    methods = ('regenerate', 'render', 'stats', 'shutdown')
+
+    def call(self, method, params):
+        if method not in self.methods:
+            raise RpcError(METHOD_NOT_FOUND, 'unknown method %s' % (method,))
+
+        function = getattr(self, method)
+
+        try:
+            if isinstance(params, dict):
+                return function(**dict((str(key), value) for key, value in params.items()))
+            else:
+                return function(*params)
+        except TypeError as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+
+    def handle(self, line):
+        """ Handle a single request line, returning the response line or None
+        for notifications. """
+
+        request_id = None
+
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise RpcError(PARSE_ERROR, 'invalid JSON')
+
+            if not isinstance(request, dict) or 'method' not in request:
+                raise RpcError(INVALID_REQUEST, 'invalid request')
+
+            request_id = request.get('id')
+            result = self.call(request['method'], request.get('params', {}))
+
+            if 'id' not in request:
+                return None
+
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        except RpcError as e:
+            response = {'jsonrpc': '2.0', 'id': request_id,
+                        'error': {'code': e.code, 'message': e.message}}
+        except Exception as e:
+            response = {'jsonrpc': '2.0', 'id': request_id,
+                        'error': {'code': SERVER_ERROR, 'message': '%s: %s' % (type(e).__name__, e)}}
+
+        return json.dumps(response) + '\n'
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+
+            response = service.handle(line)
+
+            if response:
+                self.wfile.write(response)
+                self.wfile.flush()
+
+            if not service.running:
+                break
+
+class UnixServer(SocketServer.UnixStreamServer):
+    def __init__(self, path, service):
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.service = service
+
+def serve_stdio(service, stdin=sys.stdin, stdout=sys.stdout):
+    for line in iter(stdin.readline, ''):
+        if not line.strip():
+            continue
+
+        response = service.handle(line)
+
+        if response:
+            stdout.write(response)
+            stdout.flush()
+
+        if not service.running:
+            break
+
+def serve_socket(service, path):
+    if os.path.exists(path):
+        # Remove a socket left behind by a server which is no longer running
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.remove(path)
+        else:
+            probe.close()
+            sys.stderr.write('A server is already listening on %s.\n' % (path,))
+            sys.exit(1)
+
+    server = UnixServer(path, service)
+
+    try:
+        while service.running:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def serve_main(argv):
+    parser = OptionParser(
+        usage="""\
+usage: %prog serve [options]
+
+Run a server answering JSON-RPC requests to regenerate documents and render
+Javadoc fragments, keeping parsed sources in memory between requests.""")
+
+    parser.add_option('-S', '--socket', action='store', dest='socket', default=DEFAULT_SOCKET,
+                      help='Unix socket to listen on (default: %s)' % (DEFAULT_SOCKET,))
+    parser.add_option('--stdio', action='store_true', dest='stdio',
+                      help='Serve requests on stdin and stdout instead of a socket')
+    parser.add_option('-c', '--cache-dir', action='store', dest='cache_dir',
+                      help='Directory to cache compiled sources in')
+    parser.add_option('--shared-cache-dir', action='store', dest='shared_cache_dir',
+                      help='Read-only directory of compiled sources, checked after --cache-dir')
+    parser.add_option('--ast-cache-size', type='int', dest='ast_cache_size', default=256,
+                      help='Approximate size in MB of the parsed sources kept in memory, 0 to '
+                      'disable (default: 256)')
+
+    (opts, args) = parser.parse_args(argv[2:])
+
+    if opts.cache_dir and not os.path.isdir(opts.cache_dir):
+        os.makedirs(opts.cache_dir)
+
+    # Parsed sources are the only ones kept in memory, so that all of it is
+    # bounded by --ast-cache-size
+    source_cache = cache.SourceCache(opts.cache_dir, opts.shared_cache_dir)
+    if opts.ast_cache_size > 0:
+        ast_cache = cache.ASTCache(max_bytes=opts.ast_cache_size * 1024 * 1024)
+    else:
+        ast_cache = None
+
+    service = ApidocService(source_cache, ast_cache)
+
+    if opts.stdio:
+        serve_stdio(service)
+    else:
+        serve_socket(service, opts.socket)
+
+def client_main(argv):
+    parser = OptionParser(
+        usage="""\
+usage: %prog client [options] <method> [<params>]
+
+Send a request to a server started with '%prog serve' and print the result.
+<params> is a JSON object or array.""")
+
+    parser.add_option('-S', '--socket', action='store', dest='socket', default=DEFAULT_SOCKET,
+                      help='Unix socket of the server (default: %s)' % (DEFAULT_SOCKET,))
+
+    (opts, args) = parser.parse_args(argv[2:])
+
+    if not args or len(args) > 2:
+        parser.error('A method and optional parameters are required.')
+
+    method = args[0]
+
+    try:
+        params = json.loads(args[1]) if len(args) > 1 else {}
+    except ValueError:
+        parser.error('Parameters must be valid JSON.')
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(opts.socket)
+    except socket.error as e:
+        sys.stderr.write('Could not connect to %s: %s\n' % (opts.socket, e))
+        sys.exit(1)
+
+    stream = connection.makefile('rw')
+    stream.write(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}) + '\n')
+    stream.flush()
+
+    response = json.loads(stream.readline())
+    stream.close()
+    connection.close()
+
+    if 'error' in response:
+        sys.stderr.write('Error %d: %s\n' % (response['error']['code'], response['error']['message']))
+        sys.exit(1)
+
+    print json.dumps(response['result'], indent=2, sort_keys=True)
@@ -1,6 +1,7 @@
 # Copyright (c) 2012 Bronto Software Inc.
 # Licensed under the MIT License
 
+import importlib
 import re
 
 class StringBuilder(list):
@@ -91,3 +92,18 @@ class Document(object):
         output = self.collapse_empty_lines_re.sub('\n\n', output)
 
         return output
+
+class LazyModule(object):
+    """ Stand-in for a module which is only imported once one of its
+    attributes is first used, keeping expensive imports off the startup
+    path. """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+
+        return getattr(self.__module, attr)